@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""Check and benchmark the WHOIS parsing functions against the hand-written fixtures.
+
+Every fixture in data/fixtures has an expected verdict in data/fixtures/expected.json:
+"registered", "available", "rate_limited" (must be recognized as a rate limit notice so
+it is never shown or cached as a verdict) or "error" (a failed lookup). Registered fixtures may
+also pin the parsed registrar, dates, status and name servers. A fixture with a
+"known_failure" reason is one the parser gets wrong today: it is reported as XFAIL
+and doesn't fail the check.
+
+    python bench_whois.py            # check the verdicts, then benchmark
+    python bench_whois.py --check    # only run the checks (exits 1 on a mismatch)
+
+The checks also compare check_domain_availability with the regex loop version it
+replaced, over the fixtures and a seeded set of generated outputs, and the line
+classifier with the old expiry and DNS view patterns. The benchmark times the old
+regex loop views next to the parsed record ones, over the corpus and over one
+large (about 100KB) output.
+    python bench_whois.py --seconds 2
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import whois
+
+EXPECTED_FILE = os.path.join(whois.WHOIS_FIXTURES_DIR, "expected.json")
+# Parsed fields a fixture may pin; dates are written as YYYY-MM-DD (null when absent)
+RECORD_FIELDS = ("registrar", "created", "updated", "expires", "status", "nameservers")
+# The large-output case: this fixture repeated to about this many bytes, the size of
+# a verbose registrar reply with a long legal notice
+LARGE_OUTPUT_DOMAIN = "google.com"
+LARGE_OUTPUT_BYTES = 100_000
+
+def load_fixtures() -> list:
+    """Return (domain, output, expected) for every fixture listed in expected.json."""
+    with open(EXPECTED_FILE, 'r', encoding='utf-8') as f:
+        expected = json.load(f)
+
+    fixtures = []
+    for domain, expectation in expected.items():
+        with open(whois.fixture_path(whois.WHOIS_FIXTURES_DIR, domain), 'r', encoding='utf-8') as f:
+            fixtures.append((domain, f.read(), expectation))
+    return fixtures
+
+def check_fixture(domain: str, whois_output: str, expectation: dict) -> list:
+    """Return what is wrong with the parse of one fixture (empty if it matches)."""
+    problems = []
+    verdict = expectation["verdict"]
+    record = whois.parse_whois_record(domain, whois_output)
+
+    if verdict == "error":
+        if not whois.is_whois_error(whois_output):
+            problems.append("not recognized as a failed lookup")
+    elif verdict == "rate_limited":
+        if not whois.WHOIS_QUOTA_PATTERNS.search(whois_output):
+            problems.append("rate limit message not recognized (it would be shown as a verdict)")
+    else:
+        if record.available != (verdict == "available"):
+            problems.append(f"expected {verdict}, got {'available' if record.available else 'registered'}")
+        if record.available != whois.check_domain_availability(whois_output, domain):
+            problems.append("parsed record disagrees with check_domain_availability")
+
+    for field in RECORD_FIELDS:
+        if field not in expectation:
+            continue
+        value = getattr(record, field)
+        if isinstance(value, datetime):
+            value = value.strftime('%Y-%m-%d')
+        elif isinstance(value, tuple):
+            value = list(value)
+        if value != expectation[field]:
+            problems.append(f"expected {field} {expectation[field]!r}, got {value!r}")
+    return problems
+
+# The availability check as it was before the rules were compiled into precedence
+# tables: every pattern list searched with re.search, in order. The one change is
+# 'limit exceeded' in the error patterns, which was added on purpose afterwards.
+BASELINE_COM_NET_AVAILABLE_PATTERNS = [
+    r'no match for',
+    r'domain not found',
+    r'not found: ',
+    r'no data found',
+    r'no match found for',
+    r'not found in database',
+    r'not registered',
+    r'no entries found'
+]
+BASELINE_AVAILABLE_PATTERNS = [
+    r'no match', r'not found', r'no entries found', r'no data found', r'domain not found',
+    r'domain name is not registered', r'domain is available', r'domain not registered',
+    r'domain status: available', r'status: free', r'status: available', r'no object found',
+    r'domain not exist', r'domain available', r'available for registration',
+    r'availability: available', r'query: no match'
+]
+BASELINE_UNAVAILABLE_PATTERNS = [
+    r'creation date', r'created:', r'registrar:', r'registrant', r'registered on',
+    r'domain status: ok', r'domain status: active', r'status: ok', r'status: active', r'name server:'
+]
+BASELINE_ERROR_PATTERNS = [
+    r'quota exceeded', r'too many requests', r'limit exceeded', r'connection refused', r'timeout', r'error'
+]
+
+def baseline_check_domain_availability(whois_output: str, domain: str) -> bool:
+    """The regex loop version of whois.check_domain_availability."""
+    whois_lower = whois_output.lower()
+    domain_lower = domain.lower()
+    tld = domain_lower.split('.')[-1] if '.' in domain_lower else ''
+
+    if tld in ['com', 'net']:
+        available_patterns = BASELINE_COM_NET_AVAILABLE_PATTERNS + [
+            r'domain name: (?!{})'.format(re.escape(domain_lower))
+        ]
+        unavailable_patterns = [
+            r'domain name: {}'.format(re.escape(domain_lower)),
+            r'domain status:(?!.*(free|available))',
+            r'registrar:',
+            r'registration date:',
+            r'creation date:',
+            r'name server:'
+        ]
+        for pattern in available_patterns:
+            if re.search(pattern, whois_lower):
+                return True
+        for pattern in unavailable_patterns:
+            if re.search(pattern, whois_lower):
+                return False
+        return True
+
+    for pattern in BASELINE_ERROR_PATTERNS:
+        if re.search(pattern, whois_lower):
+            return False
+    for pattern in BASELINE_AVAILABLE_PATTERNS:
+        if re.search(pattern, whois_lower):
+            return True
+    for pattern in BASELINE_UNAVAILABLE_PATTERNS:
+        if re.search(pattern, whois_lower):
+            return False
+    if len(whois_output.strip()) < 50:
+        return True
+    lines = [line for line in whois_lower.split('\n') if line.strip()]
+    return len(lines) < 5
+
+def generate_availability_cases(count: int, seed: int = 20) -> list:
+    """Return (output, domain) pairs built from the rule phrases and near misses."""
+    phrases = [rule[0] for rule in whois.AVAILABILITY_RULES + whois.COM_NET_AVAILABILITY_RULES] + [
+        "domain name: example.com", "domain name: examples.com", "domain name: exam", "DOMAIN NAME: EXAMPLE.COM",
+        "domain name: example.net", "domain name: example.co", "domain status: free", "domain status: available",
+        "domain status: clienthold", "Domain Status: OK", "status: ACTIVE", "Registrar: X", "Name Server: NS1.X",
+        "not found: x", 'no match for "x"', "Error: boom", "foo bar baz", "x" * 60
+    ]
+    domains = ["example.com", "example.net", "example.org", "example.co", "exa.io", "example"]
+    separators = ["\n", " ", "", "\n\n", ": "]
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        output = "".join(phrase + rng.choice(separators) for phrase in rng.sample(phrases, rng.randint(0, 6)))
+        if rng.random() < 0.3:
+            output = output.upper()
+        cases.append((output, rng.choice(domains)))
+    return cases
+
+def check_availability_equivalence(fixtures: list, count: int = 20000) -> bool:
+    """Compare check_domain_availability with the regex loop version and print the differences."""
+    cases = [(output, domain) for domain, output, _ in fixtures] + generate_availability_cases(count)
+    differences = 0
+    for output, domain in cases:
+        expected = baseline_check_domain_availability(output, domain)
+        if whois.check_domain_availability(output, domain) != expected:
+            differences += 1
+            if differences <= 5:
+                print(f"DIFF {domain}: expected {'available' if expected else 'registered'} for {output!r}")
+    print(f"{len(cases)} outputs compared with the regex availability check, {differences} differences")
+    return differences == 0
+
+# The expiry and DNS views as they were before lines were tagged by one classifier:
+# each line of the raw output searched with every pattern string of the view.
+BASELINE_EXPIRY_PATTERNS = [
+    r'(?i)expir(y|ation|es).*?date',
+    r'(?i)registry(\s)?expiry(\s)?date',
+    r'(?i)paid-till',
+    r'(?i)valid(\s)?until',
+    r'(?i)expiry',
+    r'(?i)expires(\s)?on'
+]
+BASELINE_DNS_PATTERNS = [
+    r'(?i)name(\s)?server',
+    r'(?i)nserver',
+    r'(?i)dns',
+    r'(?i)name(\s)?servers'
+]
+
+def baseline_matching_lines(whois_output: str, patterns: list) -> list:
+    """Return the stripped lines that match any of the patterns, the way the old views searched."""
+    found = []
+    for line in whois_output.split('\n'):
+        line = line.strip()
+        if line and any(re.search(pattern, line, re.IGNORECASE) for pattern in patterns):
+            found.append(line)
+    return found
+
+def baseline_extract_expiry_date(domain: str, whois_output: str) -> str:
+    """The regex loop version of whois.extract_expiry_date, working on the raw output."""
+    expiry_info = f"📅 <b>Expiration Date for {whois.escape_html(domain)}</b>\n\n"
+    lines = baseline_matching_lines(whois_output, BASELINE_EXPIRY_PATTERNS)
+    for line in lines:
+        expiry_info += f"{whois.escape_html(line)}\n"
+    if not lines:
+        expiry_info += "No expiration date information found in the WHOIS data."
+    expiry_info += f"\n<i>Retrieved at {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}</i>"
+    return expiry_info
+
+def baseline_extract_dns_info(domain: str, whois_output: str) -> str:
+    """The regex loop version of whois.extract_dns_info, working on the raw output."""
+    dns_info = f"🌐 <b>DNS Information for {whois.escape_html(domain)}</b>\n\n"
+    lines = baseline_matching_lines(whois_output, BASELINE_DNS_PATTERNS)
+    for line in lines:
+        dns_info += f"{whois.escape_html(line)}\n"
+    if not lines:
+        dns_info += "No DNS server information found in the WHOIS data."
+    dns_info += f"\n<i>Retrieved at {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}</i>"
+    return dns_info
+
+def check_line_tags(fixtures: list) -> bool:
+    """Compare the line classifier with the old view patterns on every fixture line."""
+    lines = differences = 0
+    for domain, whois_output, _ in fixtures:
+        record = whois.parse_whois_record(domain, whois_output)
+        for view, patterns in ((whois.LINE_EXPIRY, BASELINE_EXPIRY_PATTERNS), (whois.LINE_NAMESERVER, BASELINE_DNS_PATTERNS)):
+            tagged = [line.strip() for line in record.tagged_lines(view)]
+            expected = baseline_matching_lines(whois_output, patterns)
+            lines += len(expected)
+            if tagged != expected:
+                differences += 1
+                print(f"DIFF {domain}: tagged {tagged!r}, the old patterns match {expected!r}")
+    print(f"{lines} expiry and DNS lines compared with the old view patterns, {differences} differences")
+    return differences == 0
+
+def check_fixtures(fixtures: list) -> bool:
+    """Check every fixture and print the mismatches."""
+    failures = known_failures = 0
+    for domain, whois_output, expectation in fixtures:
+        problems = check_fixture(domain, whois_output, expectation)
+        if "known_failure" in expectation:
+            if problems:
+                known_failures += 1
+                print(f"XFAIL {domain}: {expectation['known_failure']}")
+            else:
+                print(f"XPASS {domain}: passes now, drop its known_failure note")
+            continue
+        for problem in problems:
+            failures += 1
+            print(f"FAIL {domain}: {problem}")
+    print(f"{len(fixtures)} fixtures checked, {failures} problems, {known_failures} known failures")
+    return failures == 0
+
+def benchmark(name: str, calls: list, seconds: float) -> None:
+    """Run a list of zero-argument calls round-robin and print ops/s and allocations per op."""
+    # Allocations: peak memory traced above the starting point while each call runs
+    tracemalloc.start()
+    for call in calls:
+        call()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    peaks = 0
+    for call in calls:
+        tracemalloc.reset_peak()
+        call()
+        peaks += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    ops = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for call in calls:
+            call()
+        ops += len(calls)
+    elapsed = time.perf_counter() - started
+
+    print(f"{name:28} {ops / elapsed:>12,.0f} ops/s {peaks / len(calls) / 1024:>10.1f} KB peak/op")
+
+def render_views(domain: str, record) -> tuple:
+    """Render the expiry and DNS views of a parsed record."""
+    return whois.extract_expiry_date(domain, record), whois.extract_dns_info(domain, record)
+
+def run_benchmarks(fixtures: list, seconds: float) -> None:
+    """Benchmark the parsing hot path over the whole corpus."""
+    records = [(domain, whois.parse_whois_record(domain, output)) for domain, output, _ in fixtures]
+    print(f"{'function':28} {'throughput':>18} {'allocations':>17}")
+    benchmark("is_valid_domain", [lambda d=domain: whois.is_valid_domain(d) for domain, _, _ in fixtures], seconds)
+    benchmark("check_domain_availability",
+              [lambda d=domain, o=output: whois.check_domain_availability(o, d) for domain, output, _ in fixtures],
+              seconds)
+    benchmark("parse_whois_record",
+              [lambda d=domain, o=output: whois.parse_whois_record(d, o) for domain, output, _ in fixtures],
+              seconds)
+    benchmark("format_whois_output", [lambda d=domain, r=record: whois.format_whois_output(d, r) for domain, record in records], seconds)
+    benchmark("extract_expiry_date", [lambda d=domain, r=record: whois.extract_expiry_date(d, r) for domain, record in records], seconds)
+    benchmark("extract_dns_info", [lambda d=domain, r=record: whois.extract_dns_info(d, r) for domain, record in records], seconds)
+
+    # Both views from the raw output: the regex loop versions against parsing once
+    # and rendering from the record
+    print()
+    benchmark("views, regex loops",
+              [lambda d=domain, o=output: (baseline_extract_expiry_date(d, o), baseline_extract_dns_info(d, o))
+               for domain, output, _ in fixtures],
+              seconds)
+    benchmark("views, parse + record",
+              [lambda d=domain, o=output: render_views(d, whois.parse_whois_record(d, o, is_available=False))
+               for domain, output, _ in fixtures],
+              seconds)
+    benchmark("views, cached record", [lambda d=domain, r=record: render_views(d, r) for domain, record in records], seconds)
+
+    # One large output: the regex loops scale with every line, the record only with its fields
+    print()
+    output = next(output for domain, output, _ in fixtures if domain == LARGE_OUTPUT_DOMAIN)
+    large_output = output * (LARGE_OUTPUT_BYTES // len(output) + 1)
+    print(f"{LARGE_OUTPUT_DOMAIN} repeated to {len(large_output) // 1000}KB:")
+    benchmark("large views, regex loops",
+              [lambda: (baseline_extract_expiry_date(LARGE_OUTPUT_DOMAIN, large_output),
+                        baseline_extract_dns_info(LARGE_OUTPUT_DOMAIN, large_output))],
+              seconds)
+    benchmark("large views, parse + record",
+              [lambda: render_views(LARGE_OUTPUT_DOMAIN,
+                                    whois.parse_whois_record(LARGE_OUTPUT_DOMAIN, large_output, is_available=False))],
+              seconds)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--check", action="store_true", help="only run the checks, skip the benchmarks")
+    parser.add_argument("--seconds", type=float, default=1.0, help="time spent on each benchmark")
+    args = parser.parse_args()
+
+    # Per-call log lines would dominate the timings
+    logging.disable(logging.CRITICAL)
+
+    fixtures = load_fixtures()
+    checks = [check_fixtures(fixtures), check_availability_equivalence(fixtures), check_line_tags(fixtures)]
+    if not all(checks):
+        sys.exit(1)
+    if not args.check:
+        run_benchmarks(fixtures, args.seconds)
+
+if __name__ == "__main__":
+    main()
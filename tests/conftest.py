@@ -0,0 +1,27 @@
+"""Test setup: import whois.py from the repository root and isolate its global state."""
+import os
+import sys
+import tempfile
+
+# The bot logs to whois_bot.log in the working directory unless told otherwise
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.gettempdir(), "whois_bot_tests.log"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import whois
+
+@pytest.fixture(autouse=True)
+def whois_state(tmp_path, monkeypatch):
+    """Give every test empty caches, its own cache database and a fresh lookup scheduler."""
+    monkeypatch.setattr(whois, "WHOIS_DB_FILE", str(tmp_path / "whois_cache.db"))
+    for state in (
+        whois.whois_cache, whois.whois_negative_cache, whois.whois_inflight, whois.whois_backends,
+        whois.circuit_breakers, whois.whois_rate_limiters, whois.lookup_queued, whois.prefetch_tasks
+    ):
+        state.clear()
+    yield
+    # Each test runs its own event loop, so the workers can't be reused
+    whois.stop_lookup_scheduler()
+    whois.lookup_queue = None
+    whois.close_whois_db()
@@ -0,0 +1,668 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import struct
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import bench_whois
+import whois
+
+LOOKUP_DELAY = 0.5  # seconds each fake whois call takes
+CONCURRENT_LOOKUPS = 8
+
+def install_fake_whois(directory, monkeypatch, delay: float) -> None:
+    """Put a slow whois executable first on PATH and use the local backend."""
+    script = directory / "whois"
+    script.write_text(
+        "#!/bin/sh\n"
+        f"sleep {delay}\n"
+        'echo "Domain Name: $1"\n'
+        'echo "Registrar: Example Registrar"\n'
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{directory}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(whois, "WHOIS_BACKEND", "local")
+    monkeypatch.setattr(whois, "WHOIS_RATE_BURST", 100)
+
+def press_button(data: str) -> str:
+    """Run an inline button press through the bot's handler and return the last message text."""
+    messages = []
+    async def answer():
+        pass
+    async def edit_message_text(text, **kwargs):
+        messages.append(text)
+    query = SimpleNamespace(data=data, answer=answer, edit_message_text=edit_message_text)
+    asyncio.run(whois.button_callback(SimpleNamespace(callback_query=query), None))
+    return messages[-1]
+
+def test_concurrent_lookups_take_about_as_long_as_one(tmp_path, monkeypatch):
+    install_fake_whois(tmp_path, monkeypatch, LOOKUP_DELAY)
+    domains = [f"example{i}.com" for i in range(CONCURRENT_LOOKUPS)]
+
+    async def lookup_all():
+        started = time.monotonic()
+        records = await asyncio.gather(*(whois.get_cached_whois_record(domain) for domain in domains))
+        return time.monotonic() - started, records
+
+    elapsed, records = asyncio.run(lookup_all())
+
+    assert [record.domain for record in records] == domains
+    assert not any(record.available for record in records)
+    # Run one after another they would take CONCURRENT_LOOKUPS * LOOKUP_DELAY
+    assert elapsed < 2 * LOOKUP_DELAY
+
+def test_learned_routes_leave_the_seed_file_alone(tmp_path, monkeypatch):
+    seed = tmp_path / "whois_servers.json"
+    seed_text = '{"net": {"server": "whois.verisign-grs.com", "updated": 1}, "com": {"server": "whois.verisign-grs.com", "updated": 1}}'
+    seed.write_text(seed_text)
+    learned = tmp_path / "whois_routes.json"
+    monkeypatch.setattr(whois, "WHOIS_SERVERS_FILE", str(seed))
+    monkeypatch.setattr(whois, "WHOIS_ROUTES_FILE", str(learned))
+    monkeypatch.setattr(whois, "whois_routes", {})
+    monkeypatch.setattr(whois, "whois_learned_routes", {})
+    whois.load_whois_routes()
+
+    async def fake_iana(server, query):
+        return f"refer: whois.nic.{query}\n"
+    monkeypatch.setattr(whois, "query_whois_server", fake_iana)
+
+    assert asyncio.run(whois.refresh_whois_route("dev")) == "whois.nic.dev"
+    assert seed.read_text() == seed_text
+    assert list(json.loads(learned.read_text())) == ["dev"]
+
+    # After a restart the learned route is used on top of the seed
+    whois.whois_routes.clear()
+    whois.load_whois_routes()
+    assert whois.whois_routes["dev"]["server"] == "whois.nic.dev"
+    assert whois.whois_routes["com"]["server"] == "whois.verisign-grs.com"
+
+def test_backoff_longer_than_the_deadline_fails_fast(tmp_path, monkeypatch):
+    install_fake_whois(tmp_path, monkeypatch, 0.1)
+    monkeypatch.setattr(whois, "LOOKUP_WORKERS", 2)
+    monkeypatch.setattr(whois, "WHOIS_TOTAL_TIMEOUT", 1)
+    # Four quota answers in a row: .com is blocked for 40s
+    for _ in range(4):
+        whois.report_whois_response(".com", "quota exceeded")
+
+    async def lookup_all():
+        started = time.monotonic()
+        results = await asyncio.gather(
+            *(whois.schedule_whois_lookup(f"shop{i}.com") for i in range(5)),
+            whois.schedule_whois_lookup("yandex.ru"),
+            whois.schedule_whois_lookup("bbc.co.uk"),
+            return_exceptions=True
+        )
+        return time.monotonic() - started, results
+
+    elapsed, results = asyncio.run(lookup_all())
+
+    assert all(isinstance(result, whois.WhoisRateLimitedError) for result in results[:5])
+    assert results[5].startswith("Domain Name: yandex.ru")
+    assert results[6].startswith("Domain Name: bbc.co.uk")
+    # Waiting out the deadline would take at least WHOIS_TOTAL_TIMEOUT per pair of lookups
+    assert elapsed < 0.5
+    # The backend never failed, our own limiter just refused to wait
+    assert whois.get_circuit_breaker("local:.com") == {"state": "closed", "failures": 0, "opened_at": 0.0, "probing": False}
+
+def test_tap_joining_a_prefetch_survives_the_prefetch_being_cancelled(monkeypatch):
+    monkeypatch.setattr(whois, "WHOIS_BACKEND", "fixture")
+    monkeypatch.setattr(whois, "WHOIS_FIXTURE_DELAY", 0.2)
+    monkeypatch.setattr(whois, "LOOKUP_WORKERS", 1)
+    monkeypatch.setattr(whois, "PREFETCH_ENABLED", True)
+
+    def slow_db_get(domain):
+        time.sleep(0.05)
+        return None
+    monkeypatch.setattr(whois, "whois_db_get", slow_db_get)
+
+    async def tap_then_send_another_domain():
+        # Keep the only worker busy so the lookup stays queued
+        busy = asyncio.create_task(whois.schedule_whois_lookup("busy.example.com"))
+        await asyncio.sleep(0)
+        whois.start_prefetch(1, "google.com")
+        # The user taps while the prefetch is still reading the disk cache...
+        tap = asyncio.create_task(whois.get_cached_whois_record("google.com"))
+        await asyncio.sleep(0.1)
+        assert whois.lookup_queued["google.com"]["priority"] == whois.PRIORITY_INTERACTIVE
+        # ...then sends another domain, which cancels their prefetch
+        whois.start_prefetch(1, "github.io")
+        record = await tap
+        await busy
+        return record
+
+    record = asyncio.run(tap_then_send_another_domain())
+
+    assert record.domain == "google.com"
+    assert not record.available
+
+def test_cached_verdict_is_answered_before_the_dns_precheck(monkeypatch):
+    whois.whois_cache_put("no-such-shop-4821.com", whois.parse_whois_record(
+        "no-such-shop-4821.com", 'No match for "NO-SUCH-SHOP-4821.COM".', is_available=True
+    ))
+
+    async def unexpected_precheck(domain):
+        raise AssertionError(f"DNS pre-check ran for cached {domain}")
+    monkeypatch.setattr(whois, "dns_precheck", unexpected_precheck)
+
+    assert "appears to be available" in press_button("check_no-such-shop-4821.com")
+
+@pytest.mark.parametrize("domain", ["quota.net", "limited.org", "denic-limit.de"])
+@pytest.mark.parametrize("action", ["check", "whois"])
+def test_rate_limit_notices_are_not_shown_as_a_verdict(monkeypatch, domain, action):
+    monkeypatch.setattr(whois, "WHOIS_BACKEND", "fixture")
+
+    text = press_button(f"{action}_{domain}")
+
+    assert "is limiting our queries" in text
+    assert not whois.whois_cache_peek(domain)
+
+def test_availability_check_matches_the_regex_version():
+    assert bench_whois.check_availability_equivalence(bench_whois.load_fixtures())
+
+@pytest.mark.parametrize("domain", ["failed.com", "busy.io"])
+def test_failed_lookups_are_not_shown_as_a_verdict(monkeypatch, domain):
+    monkeypatch.setattr(whois, "WHOIS_BACKEND", "fixture")
+
+    text = press_button(f"check_{domain}")
+
+    assert "failed" in text and "try again" in text
+    assert not whois.whois_cache_peek(domain)
+    assert whois.get_circuit_breaker(whois.get_whois_backend().circuit_key(domain))["failures"] == 1
+
+class ScriptedBackend(whois.WhoisBackend):
+    """A backend whose answers the test sets per TLD: WHOIS text, or an error message."""
+    name = "scripted"
+
+    def __init__(self):
+        self.answers = {}
+        self.calls = []
+
+    async def lookup(self, domain):
+        self.calls.append(domain)
+        await asyncio.sleep(0.01)
+        return self.answers.get(domain.rsplit('.', 1)[-1], f"Domain Name: {domain}\nRegistrar: Example Registrar")
+
+def install_scripted_backend(monkeypatch) -> ScriptedBackend:
+    backend = ScriptedBackend()
+    monkeypatch.setitem(whois.whois_backends, backend.name, backend)
+    monkeypatch.setattr(whois, "WHOIS_BACKEND", backend.name)
+    monkeypatch.setattr(whois, "CIRCUIT_FAILURE_THRESHOLD", 3)
+    return backend
+
+def test_circuit_opens_for_the_failing_registry_only(monkeypatch):
+    backend = install_scripted_backend(monkeypatch)
+    backend.answers["ir"] = "Error querying WHOIS server whois.nic.ir: TimeoutError()"
+
+    async def lookups():
+        for _ in range(3):
+            with pytest.raises(whois.WhoisBackendError):
+                await whois.get_whois_info("digikala.ir")
+        # Open: fails fast without asking the backend
+        with pytest.raises(whois.WhoisUnavailableError):
+            await whois.get_whois_info("digikala.ir")
+        # Every other registry is still served
+        return await whois.get_whois_info("google.com")
+
+    assert asyncio.run(lookups()).startswith("Domain Name: google.com")
+    assert backend.calls == ["digikala.ir"] * 3 + ["google.com"]
+    assert whois.get_circuit_breaker("scripted:.ir")["state"] == "open"
+    assert whois.get_circuit_breaker("scripted:.com")["state"] == "closed"
+
+def test_half_open_circuit_sends_one_probe_and_closes_on_success(monkeypatch):
+    backend = install_scripted_backend(monkeypatch)
+    backend.answers["ir"] = "Error querying WHOIS server whois.nic.ir: TimeoutError()"
+    monkeypatch.setattr(whois, "CIRCUIT_RESET_TIMEOUT", 0.05)
+
+    async def lookups():
+        for _ in range(3):
+            with pytest.raises(whois.WhoisBackendError):
+                await whois.get_whois_info("digikala.ir")
+        await asyncio.sleep(0.05)
+
+        # Half-open: the probe fails, so the circuit opens again
+        with pytest.raises(whois.WhoisBackendError):
+            await whois.get_whois_info("digikala.ir")
+        assert whois.get_circuit_breaker("scripted:.ir")["state"] == "open"
+        await asyncio.sleep(0.05)
+
+        # Half-open again: one probe goes through, the lookups next to it fail fast
+        del backend.answers["ir"]
+        return await asyncio.gather(
+            whois.get_whois_info("digikala.ir"), whois.get_whois_info("digikala.ir"), return_exceptions=True
+        )
+
+    probe, other = asyncio.run(lookups())
+
+    assert probe.startswith("Domain Name: digikala.ir")
+    assert isinstance(other, whois.WhoisUnavailableError)
+    assert backend.calls == ["digikala.ir"] * 5
+    breaker = whois.get_circuit_breaker("scripted:.ir")
+    assert (breaker["state"], breaker["failures"], breaker["probing"]) == ("closed", 0, False)
+
+def test_throttled_replies_dont_count_as_failures(monkeypatch):
+    backend = install_scripted_backend(monkeypatch)
+    backend.answers["org"] = "WHOIS LIMIT EXCEEDED - SEE WWW.PIR.ORG/WHOIS FOR DETAILS"
+
+    async def lookups():
+        for _ in range(5):
+            with pytest.raises(whois.WhoisRateLimitedError):
+                await whois.get_whois_info("wikipedia.org")
+
+    asyncio.run(lookups())
+
+    assert whois.get_circuit_breaker("scripted:.org")["failures"] == 0
+
+def test_rdap_429_is_rate_limited_not_a_failure(monkeypatch):
+    def handler(request):
+        return httpx.Response(429)
+    backend = whois.RDAPBackend()
+    backend.servers = {"com": "https://rdap.example.test/"}
+    backend.servers_updated = time.time()
+    backend.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(whois.whois_backends, "rdap", backend)
+    monkeypatch.setattr(whois, "WHOIS_BACKEND", "rdap")
+    # After the first 429 the backoff outlasts the deadline, so the rest fail fast
+    monkeypatch.setattr(whois, "WHOIS_TOTAL_TIMEOUT", 1)
+
+    async def lookups():
+        for _ in range(5):
+            with pytest.raises(whois.WhoisRateLimitedError):
+                await whois.get_whois_info("google.com")
+        await backend.close()
+
+    asyncio.run(lookups())
+
+    assert whois.get_circuit_breaker("rdap:rdap.example.test")["failures"] == 0
+
+def test_rdap_requests_are_kept_out_of_the_info_log(monkeypatch, caplog):
+    install_rdap_stand_in(monkeypatch, {"google.com": (200, RDAP_GOOGLE)})
+    backend = whois.whois_backends["rdap"]
+    backend.servers_updated = 0
+    other_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+
+    async def requests():
+        await backend.refresh_servers()
+        await backend.lookup("google.com")
+        await backend.close()
+        async with other_client:
+            await other_client.get("https://api.telegram.org/bot123/sendMessage")
+
+    with caplog.at_level(logging.INFO, logger="httpx"):
+        asyncio.run(requests())
+
+    # Only the request made outside the RDAP backend is logged at INFO
+    assert [record.getMessage().split('"')[0] for record in caplog.records if record.name == "httpx"] == [
+        "HTTP Request: GET https://api.telegram.org/bot123/sendMessage "
+    ]
+    assert not whois.rdap_request_active.get()
+
+MARKER = "@@WHOIS-test@@"
+
+def test_ssh_batch_output_is_split_by_its_frames():
+    stdout = (
+        f"{MARKER} BEGIN 0\nDomain Name: a.com\nRegistrar: X\n\n{MARKER} END 0 0\n"
+        # whois printed nothing
+        f"{MARKER} BEGIN 1\n\n{MARKER} END 1 1\n"
+        # the session broke off before this frame was closed
+        f"{MARKER} BEGIN 2\nDomain Name: c.com\n"
+    )
+
+    results = whois.parse_ssh_batch_output(stdout, MARKER)
+
+    assert results == {0: (0, "Domain Name: a.com\nRegistrar: X\n"), 1: (1, "")}
+    assert whois.parse_ssh_batch_output("", MARKER) == {}
+
+def test_slow_domain_only_fails_itself_in_an_ssh_batch(tmp_path, monkeypatch):
+    # sshpass runs the remote script locally, whois hangs for one domain
+    (tmp_path / "sshpass").write_text('#!/bin/sh\ncase "$*" in *" -N -f "*) exit 0;; esac\nfor last; do :; done\nexec sh -c "$last"\n')
+    (tmp_path / "whois").write_text('#!/bin/sh\n[ "$1" = "slow.ir" ] && sleep 5\nprintf "Domain Name: %s\\n" "$1"\n')
+    for script in ("sshpass", "whois"):
+        (tmp_path / script).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(whois, "SSH_CONTROL_DIR", str(tmp_path / "control"))
+    monkeypatch.setattr(whois, "WHOIS_HOSTS", '[{"host": "192.0.2.1", "password": "x"}]')
+    monkeypatch.setattr(whois, "WHOIS_READ_TIMEOUT", 0.5)
+    monkeypatch.setattr(whois, "WHOIS_RATE_BURST", 100)
+    monkeypatch.setattr(whois, "ssh_hosts", [])
+    whois.load_ssh_hosts()
+
+    async def lookups():
+        return await asyncio.gather(
+            *(whois.get_whois_info_ssh(domain) for domain in ("a.com", "slow.ir", "b.org", "c.net")),
+            return_exceptions=True
+        )
+
+    a, slow, b, c = asyncio.run(lookups())
+
+    assert isinstance(slow, whois.WhoisTimeoutError)
+    assert [a, b, c] == ["Domain Name: a.com\n", "Domain Name: b.org\n", "Domain Name: c.net\n"]
+    host = whois.ssh_hosts[0]
+    assert host["failures"] == 0
+    # The batch went over one pool slot, which stays in use
+    assert [slot["healthy"] for slot in host["pool"]].count(True) == 1
+
+RDAP_GOOGLE = {
+    "objectClassName": "domain",
+    "ldhName": "GOOGLE.COM",
+    "status": ["client delete prohibited", "client transfer prohibited", "server update prohibited"],
+    "entities": [{
+        "roles": ["registrar"],
+        "vcardArray": ["vcard", [["version", {}, "text", "4.0"], ["fn", {}, "text", "MarkMonitor Inc."]]],
+        "publicIds": [{"type": "IANA Registrar ID", "identifier": "292"}]
+    }],
+    "events": [
+        {"eventAction": "registration", "eventDate": "1997-09-15T04:00:00Z"},
+        {"eventAction": "expiration", "eventDate": "2028-09-14T04:00:00Z"},
+        {"eventAction": "last changed", "eventDate": "2019-09-09T15:39:04Z"}
+    ],
+    "nameservers": [{"objectClassName": "nameserver", "ldhName": "NS1.GOOGLE.COM"}, {"ldhName": "NS2.GOOGLE.COM."}],
+    "secureDNS": {"delegationSigned": False}
+}
+
+def install_rdap_stand_in(monkeypatch, responses: dict) -> list:
+    """Serve RDAP domain queries from {domain: (status, JSON body)} through httpx's mock transport."""
+    requests = []
+    def handler(request):
+        requests.append(str(request.url))
+        status, body = responses.get(request.url.path.rsplit('/', 1)[-1], (404, {"errorCode": 404}))
+        return httpx.Response(status, json=body)
+    backend = whois.RDAPBackend()
+    backend.servers = {"com": "https://rdap.example.test/"}
+    backend.servers_updated = time.time()
+    backend.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(whois.whois_backends, "rdap", backend)
+    monkeypatch.setattr(whois, "WHOIS_BACKEND", "rdap")
+    return requests
+
+def test_rdap_answers_are_read_straight_from_the_json(monkeypatch):
+    requests = install_rdap_stand_in(monkeypatch, {"google.com": (200, RDAP_GOOGLE)})
+
+    async def lookups():
+        registered = await whois.get_cached_whois_record("google.com")
+        available = await whois.get_cached_whois_record("no-such-shop-4821.com")
+        await whois.whois_backends["rdap"].close()
+        return registered, available
+
+    registered, available = asyncio.run(lookups())
+
+    assert requests == ["https://rdap.example.test/domain/google.com", "https://rdap.example.test/domain/no-such-shop-4821.com"]
+    assert not registered.available
+    assert registered.registrar == "MarkMonitor Inc."
+    assert registered.status == ("client delete prohibited", "client transfer prohibited", "server update prohibited")
+    assert [date.strftime('%Y-%m-%d') for date in (registered.created, registered.updated, registered.expires)] == [
+        "1997-09-15", "2019-09-09", "2028-09-14"
+    ]
+    assert registered.nameservers == ("ns1.google.com", "ns2.google.com")
+    assert "<b>Status:</b> client delete prohibited, client transfer prohibited, server update prohibited" in (
+        whois.format_whois_output("google.com", registered)
+    )
+    assert available.available
+
+    # Reloaded from the persistent cache, the answer reads the same
+    whois.whois_cache.clear()
+    whois.whois_negative_cache.clear()
+    reloaded = asyncio.run(whois.get_cached_whois_record("google.com"))
+    assert (reloaded.status, reloaded.expires, reloaded.nameservers) == (
+        registered.status, registered.expires, registered.nameservers
+    )
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def start_whois_servers(answers: dict, port: int) -> list:
+    """Run a fake port-43 server on each address in answers ({address: handler(query) -> bytes or None})."""
+    async def serve(handler, reader, writer):
+        query = (await reader.readline()).decode().strip()
+        answer = handler(query)
+        if answer is None:
+            # Never answer, as a hung registry would
+            await asyncio.sleep(3600)
+        writer.write(answer)
+        await writer.drain()
+        writer.close()
+    return [
+        await asyncio.start_server(lambda r, w, handler=handler: serve(handler, r, w), address, port)
+        for address, handler in answers.items()
+    ]
+
+def use_fake_whois_servers(tmp_path, monkeypatch) -> int:
+    port = free_port()
+    monkeypatch.setattr(whois, "WHOIS_PORT", port)
+    monkeypatch.setattr(whois, "WHOIS_IANA_SERVER", "127.0.0.1")
+    monkeypatch.setattr(whois, "WHOIS_ROUTES_FILE", str(tmp_path / "whois_routes.json"))
+    monkeypatch.setattr(whois, "whois_routes", {})
+    monkeypatch.setattr(whois, "whois_learned_routes", {})
+    monkeypatch.setattr(whois, "WHOIS_RATE_BURST", 100)
+    return port
+
+def test_native_client_follows_iana_registry_and_registrar_referrals(tmp_path, monkeypatch):
+    port = use_fake_whois_servers(tmp_path, monkeypatch)
+    queries = []
+    def answer(name, text):
+        def handler(query):
+            queries.append((name, query))
+            return text.encode()
+        return handler
+
+    async def lookup():
+        servers = await start_whois_servers({
+            "127.0.0.1": answer("iana", "domain:       COM\nrefer:        127.0.0.2\n"),
+            "127.0.0.2": answer("registry", "Domain Name: EXAMPLE.COM\nRegistrar WHOIS Server: 127.0.0.3\n"),
+            "127.0.0.3": answer("registrar", "Domain Name: example.com\nRegistrant Organization: Example Inc.\n")
+        }, port)
+        try:
+            return await whois.get_whois_info_native("example.com")
+        finally:
+            for server in servers:
+                server.close()
+
+    output = asyncio.run(lookup())
+
+    assert queries == [("iana", "com"), ("registry", "example.com"), ("registrar", "example.com")]
+    # The IANA answer only routes the query, the other two are shown
+    assert output == (
+        "Domain Name: EXAMPLE.COM\nRegistrar WHOIS Server: 127.0.0.3\n"
+        "Domain Name: example.com\nRegistrant Organization: Example Inc."
+    )
+    assert whois.whois_routes["com"]["server"] == "127.0.0.2"
+
+def test_native_client_caps_the_response_size(tmp_path, monkeypatch):
+    port = use_fake_whois_servers(tmp_path, monkeypatch)
+    monkeypatch.setattr(whois, "WHOIS_MAX_RESPONSE_BYTES", 4096)
+
+    async def query():
+        servers = await start_whois_servers({"127.0.0.2": lambda query: b"x" * 100000}, port)
+        try:
+            return await whois.query_whois_server("127.0.0.2", "example.com")
+        finally:
+            for server in servers:
+                server.close()
+
+    assert asyncio.run(query()) == "x" * 4096
+
+def test_native_client_read_timeout_raises_a_timeout_error(tmp_path, monkeypatch):
+    port = use_fake_whois_servers(tmp_path, monkeypatch)
+    monkeypatch.setattr(whois, "WHOIS_READ_TIMEOUT", 0.2)
+    whois.whois_routes["com"] = {"server": "127.0.0.2", "updated": time.time()}
+
+    async def lookup():
+        servers = await start_whois_servers({"127.0.0.2": lambda query: None}, port)
+        try:
+            started = time.monotonic()
+            with pytest.raises(whois.WhoisTimeoutError):
+                await whois.get_whois_info_native("example.com")
+            return time.monotonic() - started
+        finally:
+            for server in servers:
+                server.close()
+
+    assert asyncio.run(lookup()) < 1
+
+def dns_answer(query: bytes, rcode: int = 0, records: list = (), query_id: bytes = None, question: bytes = None) -> bytes:
+    """Build a resolver reply to a query, with (type, data) answer records for the queried name."""
+    header = (query_id or query[:2]) + struct.pack("!HHHHH", 0x8180 | rcode, 1, len(records), 0, 0)
+    answers = b"".join(
+        struct.pack("!HHHIH", 0xC00C, record_type, whois.DNS_CLASS_IN, 300, len(data)) + data
+        for record_type, data in records
+    )
+    return header + (question or query[12:]) + answers
+
+NS_DATA = b"\x03ns1\x06google\x03com\x00"
+CNAME_DATA = b"\x05alias\x07example\x03net\x00"
+
+@pytest.mark.parametrize("case, expected", [
+    ("delegated", True),
+    ("cname_then_ns", True),
+    ("nxdomain", False),
+    ("servfail", None),
+    ("nodata", None),
+    ("stray_id_first", True),
+    ("other_question", None),
+])
+def test_dns_delegation_lookup_reads_the_resolver_reply(monkeypatch, case, expected):
+    def reply(query):
+        if case == "delegated":
+            return [dns_answer(query, records=[(whois.DNS_TYPE_NS, NS_DATA)])]
+        if case == "cname_then_ns":
+            return [dns_answer(query, records=[(5, CNAME_DATA), (whois.DNS_TYPE_NS, NS_DATA)])]
+        if case == "nxdomain":
+            return [dns_answer(query, rcode=whois.DNS_RCODE_NXDOMAIN)]
+        if case == "servfail":
+            return [dns_answer(query, rcode=2)]
+        if case == "nodata":
+            return [dns_answer(query)]
+        if case == "stray_id_first":
+            # A late reply to some other query is ignored, ours still counts
+            stray_id = bytes([query[0] ^ 0xFF, query[1]])
+            return [dns_answer(query, rcode=whois.DNS_RCODE_NXDOMAIN, query_id=stray_id),
+                    dns_answer(query, records=[(whois.DNS_TYPE_NS, NS_DATA)])]
+        if case == "other_question":
+            other = b"\x07example\x03org\x00" + struct.pack("!HH", whois.DNS_TYPE_NS, whois.DNS_CLASS_IN)
+            return [dns_answer(query, records=[(whois.DNS_TYPE_NS, NS_DATA)], question=other)]
+
+    assert asyncio.run(lookup_with_stub_resolver(monkeypatch, reply)) is expected
+
+def test_dns_precheck_treats_a_truncated_reply_as_inconclusive(monkeypatch):
+    monkeypatch.setattr(whois, "DNS_PRECHECK_ENABLED", True)
+    def reply(query):
+        return [dns_answer(query, records=[(whois.DNS_TYPE_NS, NS_DATA)])[:-len(NS_DATA) - 6]]
+
+    assert asyncio.run(lookup_with_stub_resolver(monkeypatch, reply, whois.dns_precheck)) is False
+    assert whois.dns_precheck_stats["inconclusive"] == 1
+
+def test_dns_precheck_gives_up_on_a_silent_resolver(monkeypatch):
+    monkeypatch.setattr(whois, "DNS_PRECHECK_ENABLED", True)
+    monkeypatch.setattr(whois, "DNS_PRECHECK_TIMEOUT", 0.2)
+
+    started = time.monotonic()
+    assert asyncio.run(lookup_with_stub_resolver(monkeypatch, lambda query: [], whois.dns_precheck)) is False
+    assert time.monotonic() - started < 1
+    assert whois.dns_precheck_stats["inconclusive"] == 1
+
+async def lookup_with_stub_resolver(monkeypatch, reply, lookup=whois.lookup_dns_delegation):
+    """Run a lookup of google.com against a local UDP resolver that answers with reply(query)."""
+    class StubResolver(asyncio.DatagramProtocol):
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def datagram_received(self, data, addr):
+            for datagram in reply(data):
+                self.transport.sendto(datagram, addr)
+
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(StubResolver, local_addr=("127.0.0.1", 0))
+    monkeypatch.setattr(whois, "DNS_RESOLVER", "127.0.0.1")
+    monkeypatch.setattr(whois, "DNS_RESOLVER_PORT", transport.get_extra_info("sockname")[1])
+    for key in whois.dns_precheck_stats:
+        monkeypatch.setitem(whois.dns_precheck_stats, key, 0)
+    try:
+        return await lookup("google.com")
+    finally:
+        transport.close()
+
+class HedgeLeg(whois.WhoisBackend):
+    """One side of a hedged backend: answers (or raises) after a delay, noting cancellations."""
+
+    def __init__(self, name, answer, delay):
+        self.name = name
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = 0
+
+    async def lookup(self, domain):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+def install_hedged_backend(monkeypatch, primary: HedgeLeg, secondary: HedgeLeg) -> whois.HedgedBackend:
+    for leg in (primary, secondary):
+        monkeypatch.setitem(whois.whois_backends, leg.name, leg)
+    monkeypatch.setattr(whois, "WHOIS_PRIMARY_BACKEND", primary.name)
+    monkeypatch.setattr(whois, "WHOIS_SECONDARY_BACKEND", secondary.name)
+    monkeypatch.setattr(whois, "WHOIS_HEDGE_MIN_DELAY", 0.05)
+    monkeypatch.setattr(whois, "WHOIS_FAILOVER_THRESHOLD", 2)
+    for key in whois.hedge_stats:
+        monkeypatch.setitem(whois.hedge_stats, key, 0)
+    return whois.HedgedBackend()
+
+def test_hedged_lookup_takes_the_secondary_when_the_primary_is_slow(monkeypatch):
+    primary = HedgeLeg("primary", "Domain Name: google.com\nfrom primary", 5)
+    secondary = HedgeLeg("secondary", "Domain Name: google.com\nfrom secondary", 0.01)
+    backend = install_hedged_backend(monkeypatch, primary, secondary)
+
+    async def lookup():
+        started = time.monotonic()
+        answer = await backend.lookup("google.com")
+        await asyncio.sleep(0)
+        assert primary.cancelled == 1
+        return answer, time.monotonic() - started
+
+    answer, elapsed = asyncio.run(lookup())
+    assert answer.endswith("from secondary")
+    assert elapsed < 1
+    assert whois.hedge_stats["hedged"] == 1 and whois.hedge_stats["secondary_wins"] == 1
+
+@pytest.mark.parametrize("failure", ["Error querying WHOIS server whois.verisign-grs.com: ConnectionResetError()",
+                                     ConnectionResetError()])
+def test_hedged_lookup_fails_over_and_then_skips_a_failing_primary(monkeypatch, failure):
+    primary = HedgeLeg("primary", failure, 0.01)
+    secondary = HedgeLeg("secondary", "Domain Name: google.com\nfrom secondary", 0.01)
+    backend = install_hedged_backend(monkeypatch, primary, secondary)
+
+    async def lookups():
+        return [await backend.lookup("google.com") for _ in range(3)]
+
+    assert all(answer.endswith("from secondary") for answer in asyncio.run(lookups()))
+    # WHOIS_FAILOVER_THRESHOLD failures take the primary out for the cooldown
+    assert primary.calls == 2 and secondary.calls == 3
+    assert whois.hedge_stats["failovers"] == 1
+
+def test_hedged_lookup_cancels_the_primary_when_the_deadline_hits_during_its_head_start(monkeypatch):
+    primary = HedgeLeg("primary", "Domain Name: google.com", 5)
+    secondary = HedgeLeg("secondary", "Domain Name: google.com", 0.01)
+    backend = install_hedged_backend(monkeypatch, primary, secondary)
+    monkeypatch.setattr(whois, "WHOIS_HEDGE_MIN_DELAY", 1)
+
+    async def lookup():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(backend.lookup("google.com"), timeout=0.05)
+        await asyncio.sleep(0)
+        # Checked before asyncio.run() cancels whatever is left over
+        assert primary.cancelled == 1
+        assert secondary.calls == 0
+
+    asyncio.run(lookup())
@@ -1,11 +1,25 @@
 #!/usr/bin/env python3
+import asyncio
+import atexit
+import contextvars
 import logging
-import subprocess
 import os
 import re
+import secrets
+import shlex
+import signal
 import json
+import queue
 import html
-from datetime import datetime
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import httpx
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes, ConversationHandler
 from telegram.constants import ParseMode
@@ -14,16 +28,79 @@ from dotenv import load_dotenv
 # Load environment variables from .env file if it exists
 load_dotenv()
 
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler("whois_bot.log"),
-        logging.StreamHandler()
-    ]
-)
+# Logging settings
+LOG_FILE = os.environ.get("LOG_FILE", "whois_bot.log")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # rotate the log file at this size
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+LOG_SAMPLE_RATE = max(1, int(os.environ.get("LOG_SAMPLE_RATE", "100")))  # keep 1 in N per-lookup debug events
+
+class SamplingFilter(logging.Filter):
+    """Let through only one in every `rate` records."""
+    
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self.seen = 0
+    
+    def filter(self, record):
+        keep = self.seen % self.rate == 0
+        self.seen += 1
+        return keep
+
+class GetUpdatesFilter(logging.Filter):
+    """Drop httpx's request line for every getUpdates long poll."""
+    
+    def filter(self, record):
+        return "getUpdates" not in record.getMessage()
+
+class RDAPRequestFilter(logging.Filter):
+    """Turn httpx's request line for each RDAP request into a sampled per-lookup DEBUG event."""
+    
+    def filter(self, record):
+        if not rdap_request_active.get():
+            return True
+        lookup_logger.debug(record.getMessage())
+        return False
+
+# Enable logging. Records are queued and written by a background thread, so a slow
+# disk never blocks the event loop.
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_file_handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+log_stream_handler = logging.StreamHandler()
+for handler in (log_file_handler, log_stream_handler):
+    handler.setFormatter(log_formatter)
+log_queue = queue.Queue()
+log_listener = QueueListener(log_queue, log_file_handler, log_stream_handler)
+log_listener.start()
+# Flush whatever is still queued when the process exits
+atexit.register(log_listener.stop)
+
+log_queue_handler = QueueHandler(log_queue)
+# Only the listener's handlers format records, with the full format above
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=LOG_LEVEL, handlers=[log_queue_handler])
+logging.getLogger("httpx").addFilter(GetUpdatesFilter())
+logging.getLogger("httpx").addFilter(RDAPRequestFilter())
 logger = logging.getLogger(__name__)
+# Per-lookup details (e.g. which availability rule matched), sampled at DEBUG level
+lookup_logger = logging.getLogger(f"{__name__}.lookup")
+lookup_logger.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+
+class WhoisLookupError(Exception):
+    """Base class for lookups that failed without producing any WHOIS output."""
+
+class WhoisTimeoutError(WhoisLookupError):
+    """Raised when a WHOIS lookup misses its deadline."""
+
+class WhoisUnavailableError(WhoisLookupError):
+    """Raised when the lookup backend's circuit breaker is open."""
+
+class WhoisRateLimitedError(WhoisLookupError):
+    """Raised when a WHOIS server's rate limit won't allow a query before the lookup's deadline."""
+
+class WhoisBackendError(WhoisLookupError):
+    """Raised when the backend answered with an error message instead of WHOIS data."""
 
 # Configuration
 TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "7802439345:AAGBzFUgO7IeApWvWRfIDMOSDfxvj2Br9Pg")
@@ -32,6 +109,99 @@ ROOT_PASSWORD = os.environ.get("ROOT_PASSWORD", "")  # Get from environment vari
 ADMIN_USER_ID = int(os.environ.get("ADMIN_USER_ID", "402031454"))
 DOMAIN_REGISTER_URL = "https://www.hostinger.com/domain-name-search"
 
+# SSH connection pool settings
+SSH_POOL_SIZE = max(1, int(os.environ.get("SSH_POOL_SIZE", "2")))
+SSH_HEALTH_CHECK_INTERVAL = int(os.environ.get("SSH_HEALTH_CHECK_INTERVAL", "60"))  # seconds
+SSH_BATCH_WINDOW = float(os.environ.get("SSH_BATCH_WINDOW_MS", "15")) / 1000  # seconds
+SSH_BATCH_MAX_SIZE = max(1, int(os.environ.get("SSH_BATCH_MAX_SIZE", "10")))
+SSH_CONTROL_DIR = os.environ.get("SSH_CONTROL_DIR", os.path.join(tempfile.gettempdir(), "whoisbot-ssh"))
+SSH_BATCH_TIMEOUT_EXIT_CODE = 124  # what the remote `timeout` exits with when a whois run overruns
+
+# WHOIS relay hosts: WHOIS_HOSTS (JSON) or data/whois_hosts.json, e.g.
+# [{"host": "203.0.113.10", "user": "root", "password": "...", "weight": 2}, ...]
+# Without either, SERVER_IP/ROOT_PASSWORD is the only host.
+WHOIS_HOSTS = os.environ.get("WHOIS_HOSTS", "")
+SSH_HOST_EJECT_THRESHOLD = int(os.environ.get("SSH_HOST_EJECT_THRESHOLD", "3"))  # consecutive failures
+SSH_HOST_EJECT_TIME = float(os.environ.get("SSH_HOST_EJECT_TIME", "30"))  # seconds, doubled while it keeps failing
+
+# Lookup backend: "ssh" runs whois on the relay hosts (SERVER_IP by default), "local" runs
+# the whois binary on this box, "native" queries port 43 directly, "rdap" queries registries
+# over RDAP, "fixture" replays WHOIS outputs saved on disk and "hedged" combines a primary
+# and a secondary backend
+WHOIS_BACKEND = os.environ.get("WHOIS_BACKEND", "ssh").lower()
+WHOIS_FIXTURE_DELAY = float(os.environ.get("WHOIS_FIXTURE_DELAY_MS", "0")) / 1000  # seconds
+RDAP_BOOTSTRAP_URL = os.environ.get("RDAP_BOOTSTRAP_URL", "https://data.iana.org/rdap/dns.json")
+RDAP_FALLBACK_BACKEND = os.environ.get("RDAP_FALLBACK_BACKEND", "ssh").lower()  # for TLDs without RDAP
+RDAP_MAX_CONNECTIONS = int(os.environ.get("RDAP_MAX_CONNECTIONS", "20"))
+# Hedging/failover policy ("hedged" backend): the secondary is asked too when the
+# primary is slower than its usual WHOIS_HEDGE_PERCENTILE latency, or fails
+WHOIS_PRIMARY_BACKEND = os.environ.get("WHOIS_PRIMARY_BACKEND", "ssh").lower()
+WHOIS_SECONDARY_BACKEND = os.environ.get("WHOIS_SECONDARY_BACKEND", "native").lower()
+WHOIS_HEDGE_PERCENTILE = float(os.environ.get("WHOIS_HEDGE_PERCENTILE", "95"))
+WHOIS_HEDGE_MIN_DELAY = float(os.environ.get("WHOIS_HEDGE_MIN_DELAY", "0.5"))  # seconds
+WHOIS_HEDGE_MIN_SAMPLES = 20
+WHOIS_FAILOVER_THRESHOLD = int(os.environ.get("WHOIS_FAILOVER_THRESHOLD", "3"))  # consecutive failures
+WHOIS_FAILOVER_COOLDOWN = float(os.environ.get("WHOIS_FAILOVER_COOLDOWN", "60"))  # seconds
+# Circuit breaker around the lookup backend
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))  # consecutive failures
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))  # seconds before a probe
+WHOIS_RECORD_DIR = os.environ.get("WHOIS_RECORD_DIR", "")  # save every backend output here when set
+
+# Native WHOIS client settings
+WHOIS_IANA_SERVER = "whois.iana.org"
+WHOIS_PORT = 43
+WHOIS_CONNECT_TIMEOUT = float(os.environ.get("WHOIS_CONNECT_TIMEOUT", "5"))  # seconds
+WHOIS_READ_TIMEOUT = float(os.environ.get("WHOIS_READ_TIMEOUT", "10"))  # seconds, per read / remote command
+WHOIS_TOTAL_TIMEOUT = float(os.environ.get("WHOIS_TOTAL_TIMEOUT", "20"))  # seconds, whole lookup
+WHOIS_MAX_RESPONSE_BYTES = int(os.environ.get("WHOIS_MAX_RESPONSE_BYTES", "262144"))
+WHOIS_MAX_REFERRALS = int(os.environ.get("WHOIS_MAX_REFERRALS", "3"))
+WHOIS_ROUTE_TTL = int(os.environ.get("WHOIS_ROUTE_TTL", str(30 * 24 * 3600)))  # seconds
+
+# WHOIS result cache settings
+WHOIS_CACHE_TTL = int(os.environ.get("WHOIS_CACHE_TTL", "600"))  # seconds
+WHOIS_CACHE_MAX_ENTRIES = int(os.environ.get("WHOIS_CACHE_MAX_ENTRIES", "1024"))
+
+# "Available" verdicts are cached separately and only briefly, since people keep re-checking them
+WHOIS_NEGATIVE_CACHE_TTL = int(os.environ.get("WHOIS_NEGATIVE_CACHE_TTL", "120"))  # seconds
+WHOIS_NEGATIVE_CACHE_MAX_ENTRIES = int(os.environ.get("WHOIS_NEGATIVE_CACHE_MAX_ENTRIES", "4096"))
+
+# Lookup scheduler: at most LOOKUP_WORKERS backend lookups run at once
+LOOKUP_WORKERS = max(1, int(os.environ.get("LOOKUP_WORKERS", "8")))
+
+# Lookup priorities (lower runs first)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_PREFETCH: "prefetch", PRIORITY_BULK: "bulk"}
+
+# Speculative prefetch: start a low-priority lookup as soon as a domain is sent
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "1") != "0"
+PREFETCH_MAX_INFLIGHT = max(1, int(os.environ.get("PREFETCH_MAX_INFLIGHT", "2")))
+
+# DNS pre-check: a domain delegated in its parent zone (has NS records) is registered,
+# so the availability check can answer "taken" without a WHOIS round trip
+DNS_PRECHECK_ENABLED = os.environ.get("DNS_PRECHECK_ENABLED", "0") != "0"
+DNS_RESOLVER = os.environ.get("DNS_RESOLVER", "1.1.1.1")
+DNS_RESOLVER_PORT = int(os.environ.get("DNS_RESOLVER_PORT", "53"))
+DNS_PRECHECK_TIMEOUT = float(os.environ.get("DNS_PRECHECK_TIMEOUT", "1"))  # seconds
+
+# Per-WHOIS-server rate limiting (token bucket with backoff on quota responses)
+WHOIS_RATE_LIMIT = float(os.environ.get("WHOIS_RATE_LIMIT", "1"))  # queries per second per server
+WHOIS_RATE_BURST = int(os.environ.get("WHOIS_RATE_BURST", "5"))
+WHOIS_BACKOFF_INITIAL = float(os.environ.get("WHOIS_BACKOFF_INITIAL", "5"))  # seconds
+WHOIS_BACKOFF_MAX = float(os.environ.get("WHOIS_BACKOFF_MAX", "300"))  # seconds
+
+# Persistent WHOIS cache settings (TTL is derived from the domain's expiry date)
+WHOIS_DB_MIN_TTL = int(os.environ.get("WHOIS_DB_MIN_TTL", "600"))  # seconds
+WHOIS_DB_DEFAULT_TTL = int(os.environ.get("WHOIS_DB_DEFAULT_TTL", str(6 * 3600)))  # seconds
+WHOIS_DB_MAX_TTL = int(os.environ.get("WHOIS_DB_MAX_TTL", str(7 * 24 * 3600)))  # seconds
+WHOIS_DB_STALE_GRACE = int(os.environ.get("WHOIS_DB_STALE_GRACE", str(24 * 3600)))  # keep expired rows for outages
+WHOIS_DB_CLEANUP_INTERVAL = int(os.environ.get("WHOIS_DB_CLEANUP_INTERVAL", "3600"))  # seconds
+WHOIS_EXPIRING_SOON_DAYS = int(os.environ.get("WHOIS_EXPIRING_SOON_DAYS", "30"))  # reported in /stats
+
+# Outputs starting with these are lookup failures, not WHOIS data
+WHOIS_ERROR_PREFIXES = ("Error ", "Error:", "Failed to execute")
+
 # Data directory
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -39,6 +209,12 @@ os.makedirs(DATA_DIR, exist_ok=True)
 # File paths
 USERS_FILE = os.path.join(DATA_DIR, "users.json")
 CONFIG_FILE = os.path.join(DATA_DIR, "config.json")
+WHOIS_SERVERS_FILE = os.path.join(DATA_DIR, "whois_servers.json")  # seed routes, read only
+WHOIS_ROUTES_FILE = os.path.join(DATA_DIR, "whois_routes.json")  # routes learned from IANA
+WHOIS_DB_FILE = os.path.join(DATA_DIR, "whois_cache.db")
+RDAP_SERVERS_FILE = os.path.join(DATA_DIR, "rdap_servers.json")
+WHOIS_HOSTS_FILE = os.path.join(DATA_DIR, "whois_hosts.json")
+WHOIS_FIXTURES_DIR = os.environ.get("WHOIS_FIXTURES_DIR", os.path.join(DATA_DIR, "fixtures"))
 
 # Recent searches cache
 recent_searches = []
@@ -50,6 +226,69 @@ users = set()
 # Conversation states
 BROADCAST_MESSAGE = 1
 
+# WHOIS relay hosts, each with its own connection pool, batch queue and health state
+ssh_hosts = []
+ssh_health_task = None
+
+# Lookup backend instances by name, created on first use
+whois_backends = {}
+hedge_stats = {"requests": 0, "hedged": 0, "secondary_wins": 0, "failovers": 0}
+
+# Circuit breakers by backend and upstream server ("native:whois.nic.ir")
+circuit_breakers = {}
+
+# TLD -> WHOIS server routing table ({"com": {"server": "...", "updated": 1700000000}}),
+# the seed file overlaid with the routes learned at runtime
+whois_routes = {}
+whois_learned_routes = {}
+whois_routes_lock = threading.Lock()
+whois_route_refreshes = {}
+
+# Lookup scheduler state
+lookup_queue = None
+lookup_workers = []
+lookup_queued = {}  # normalized domain -> scheduled lookup, until it finishes
+lookup_sequence = 0
+lookup_stats = {
+    name: {"queued": 0, "completed": 0, "wait_total": 0.0, "wait_max": 0.0}
+    for name in PRIORITY_NAMES.values()
+}
+
+# Prefetch state (user id -> (domain, task))
+prefetch_tasks = {}
+prefetch_inflight = 0
+prefetch_stats = {"started": 0, "completed": 0, "skipped": 0, "cancelled": 0}
+
+# DNS pre-check outcomes
+dns_precheck_stats = {"queries": 0, "registered": 0, "nxdomain": 0, "inconclusive": 0}
+
+# Rate limiter state per upstream WHOIS server
+whois_rate_limiters = {}
+# When (time.monotonic()) the backend lookup running in the current task must be done
+whois_lookup_deadline = contextvars.ContextVar("whois_lookup_deadline", default=None)
+# Set while the current task is making an RDAP request, so httpx's line for it is sampled
+rdap_request_active = contextvars.ContextVar("rdap_request_active", default=False)
+
+# WHOIS result caches (normalized domain -> (expires_at, output)), oldest first.
+# Registered domains and "available" verdicts are kept apart so brainstorming
+# churn can't evict the long-lived entries.
+whois_cache = OrderedDict()
+whois_negative_cache = OrderedDict()
+whois_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "negative_hits": 0}
+
+# Lookups currently in flight, shared by concurrent callers
+# (normalized domain -> {"task": ..., "priority": most urgent priority asked for})
+whois_inflight = {}
+whois_inflight_stats = {"backend_calls": 0, "coalesced": 0, "db_hits": 0, "stale_served": 0}
+
+# Persistent WHOIS cache (SQLite connection shared by worker threads)
+whois_db = None
+whois_db_lock = threading.Lock()
+whois_db_cleanup_task = None
+
+# WHOIS date formats that worked, keyed by the shape of the value (digits blanked out)
+whois_date_formats = {}
+
 # Function to escape HTML special characters
 def escape_html(text):
     """Escape HTML special characters in text."""
@@ -183,11 +422,35 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     
     total_users = len(users)
     total_searches = len(recent_searches)
+    cache_lookups = whois_cache_stats["hits"] + whois_cache_stats["misses"]
+    cache_hit_rate = (whois_cache_stats["hits"] / cache_lookups * 100) if cache_lookups else 0
+    try:
+        expiring_soon = len(await asyncio.to_thread(whois_db_expiring, WHOIS_EXPIRING_SOON_DAYS))
+    except Exception as e:
+        logger.error(f"Error reading the WHOIS cache database: {e}")
+        expiring_soon = 0
     
     stats_text = (
         "📊 <b>Bot Statistics</b>\n\n"
         f"• Total users: {total_users}\n"
-        f"• Total searches: {total_searches}\n\n"
+        f"• Total searches: {total_searches}\n"
+        f"• WHOIS cache: {len(whois_cache)} entries, "
+        f"{whois_cache_stats['hits']} hits / {whois_cache_stats['misses']} misses ({cache_hit_rate:.0f}%), "
+        f"{len(whois_negative_cache)} cached \"available\" verdicts, "
+        f"{expiring_soon} cached domains expiring within {WHOIS_EXPIRING_SOON_DAYS} days\n"
+        f"• Backend lookups: {whois_inflight_stats['backend_calls']} "
+        f"({whois_inflight_stats['coalesced']} saved by coalescing, "
+        f"{whois_inflight_stats['db_hits']} served from disk)\n"
+        f"• Lookup queue: {escape_html(lookup_queue_summary())}\n"
+        f"• Prefetches: {prefetch_stats['started']} started, {prefetch_stats['completed']} completed, "
+        f"{prefetch_stats['cancelled']} cancelled, {prefetch_stats['skipped']} skipped\n"
+        f"• DNS pre-check: {dns_precheck_stats['queries']} queries, {dns_precheck_stats['registered']} answered as registered, "
+        f"{dns_precheck_stats['nxdomain']} NXDOMAIN, {dns_precheck_stats['inconclusive']} inconclusive\n"
+        f"• WHOIS hosts: {escape_html(ssh_hosts_summary())}\n"
+        f"• Circuit breakers: {escape_html(circuit_summary())}, "
+        f"{whois_inflight_stats['stale_served']} stale answers served\n"
+        f"• Hedging: {hedge_stats['hedged']}/{hedge_stats['requests']} hedged, "
+        f"{hedge_stats['secondary_wins']} answered by secondary, {hedge_stats['failovers']} failovers\n\n"
         f"<i>Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}</i>"
     )
     
@@ -247,6 +510,37 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.message.reply_text("Operation canceled.")
     return ConversationHandler.END
 
+async def show_lookup_failure(query, domain: str, error: Exception) -> None:
+    """Tell the user a lookup failed, timed out or the service is down, and offer to retry it."""
+    keyboard = [
+        [InlineKeyboardButton("🔄 Try again", callback_data=query.data)],
+        [InlineKeyboardButton("◀️ Back to options", callback_data=f"domain_{domain}")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    if isinstance(error, WhoisUnavailableError):
+        text = (
+            f"⚠️ WHOIS lookups are temporarily unavailable, so <b>{escape_html(domain)}</b> "
+            "couldn't be checked right now. Please try again in a minute."
+        )
+    elif isinstance(error, WhoisRateLimitedError):
+        text = (
+            f"⏳ The WHOIS server for <b>{escape_html(domain)}</b> is limiting our queries right now. "
+            "Please try again in a minute."
+        )
+    elif isinstance(error, WhoisBackendError):
+        text = (
+            f"⚠️ The lookup for <b>{escape_html(domain)}</b> failed, "
+            "the WHOIS server couldn't be queried. Please try again in a moment."
+        )
+    else:
+        text = (
+            f"⏱ The lookup for <b>{escape_html(domain)}</b> timed out. "
+            "The WHOIS server didn't answer in time, please try again in a moment."
+        )
+    
+    await query.edit_message_text(text=text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle button callbacks."""
     query = update.callback_query
@@ -284,6 +578,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     elif query.data.startswith("domain_"):
         domain = query.data[7:]  # Remove "domain_" prefix
+        start_prefetch(update.effective_user.id, domain)
         
         # Show options when domain is entered
         keyboard = [
@@ -307,10 +602,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text(text=f"Looking up WHOIS for {domain}...")
         
         try:
-            whois_output = get_whois_info(domain)
+            record = await get_cached_whois_record(domain)
             
             # Check if domain is available
-            is_available = check_domain_availability(whois_output, domain)
+            is_available = record.available
             
             if is_available:
                 # Domain is available
@@ -330,7 +625,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             else:
                 # Domain is registered - show WHOIS info
                 # Format the output
-                formatted_output = format_whois_output(domain, whois_output)
+                formatted_output = format_whois_output(domain, record)
                 
                 # Create back button
                 keyboard = [
@@ -352,6 +647,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 else:
                     await query.edit_message_text(text=formatted_output, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
                 
+        except WhoisLookupError as e:
+            logger.warning(f"Lookup failed for {domain}: {str(e)}")
+            await show_lookup_failure(query, domain, e)
+        
         except Exception as e:
             logger.error(f"Error getting WHOIS for {domain}: {str(e)}")
             await query.edit_message_text(text=f"Error getting WHOIS information: {str(e)}")
@@ -361,10 +660,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text(text=f"Fetching expiration date for {domain}...")
         
         try:
-            whois_output = get_whois_info(domain)
+            record = await get_cached_whois_record(domain)
             
             # Check if domain is available
-            is_available = check_domain_availability(whois_output, domain)
+            is_available = record.available
             
             if is_available:
                 # Domain is available
@@ -383,7 +682,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 )
             else:
                 # Domain is registered - show expiry info
-                expiry_info = extract_expiry_date(domain, whois_output)
+                expiry_info = extract_expiry_date(domain, record)
                 
                 # Create back button
                 keyboard = [
@@ -398,6 +697,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     parse_mode=ParseMode.HTML
                 )
                 
+        except WhoisLookupError as e:
+            logger.warning(f"Lookup failed for {domain}: {str(e)}")
+            await show_lookup_failure(query, domain, e)
+        
         except Exception as e:
             logger.error(f"Error getting expiry date for {domain}: {str(e)}")
             await query.edit_message_text(text=f"Error getting expiration date: {str(e)}")
@@ -407,10 +710,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text(text=f"Fetching DNS information for {domain}...")
         
         try:
-            whois_output = get_whois_info(domain)
+            record = await get_cached_whois_record(domain)
             
             # Check if domain is available
-            is_available = check_domain_availability(whois_output, domain)
+            is_available = record.available
             
             if is_available:
                 # Domain is available
@@ -429,7 +732,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 )
             else:
                 # Domain is registered - show DNS info
-                dns_info = extract_dns_info(domain, whois_output)
+                dns_info = extract_dns_info(domain, record)
                 
                 # Create back button
                 keyboard = [
@@ -444,24 +747,38 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     parse_mode=ParseMode.HTML
                 )
                 
+        except WhoisLookupError as e:
+            logger.warning(f"Lookup failed for {domain}: {str(e)}")
+            await show_lookup_failure(query, domain, e)
+        
         except Exception as e:
             logger.error(f"Error getting DNS info for {domain}: {str(e)}")
             await query.edit_message_text(text=f"Error getting DNS information: {str(e)}")
     
-    elif query.data.startswith("check_"):
-        domain = query.data[6:]  # Remove "check_" prefix
+    elif query.data.startswith("check_") or query.data.startswith("recheck_"):
+        domain = query.data.split("_", 1)[1]  # Remove "check_"/"recheck_" prefix
         await query.edit_message_text(text=f"Checking availability for {domain}...")
         
+        # The user explicitly asked for a fresh answer
+        if query.data.startswith("recheck_"):
+            await invalidate_whois_cache(domain)
+        
         try:
-            whois_output = get_whois_info(domain)
-            
-            # Check if domain is available
-            is_available = check_domain_availability(whois_output, domain)
+            # A cached verdict is the fastest answer; on a miss, a delegated domain is
+            # registered and there's no need to wait for WHOIS
+            if not whois_cache_peek(domain) and await dns_precheck(domain):
+                is_available = False
+            else:
+                record = await get_cached_whois_record(domain)
+                
+                # Check if domain is available
+                is_available = record.available
             
             if is_available:
                 # Domain is available
                 keyboard = [
                     [InlineKeyboardButton("🛒 Register This Domain", url=f"{DOMAIN_REGISTER_URL}?domain={domain}")],
+                    [InlineKeyboardButton("🔄 Check again", callback_data=f"recheck_{domain}")],
                     [InlineKeyboardButton("◀️ Back to options", callback_data=f"domain_{domain}")],
                     [InlineKeyboardButton("🔍 Search another domain", callback_data="how_to_use")]
                 ]
@@ -477,6 +794,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 # Domain is not available
                 keyboard = [
                     [InlineKeyboardButton("🔎 View WHOIS Details", callback_data=f"whois_{domain}")],
+                    [InlineKeyboardButton("🔄 Check again", callback_data=f"recheck_{domain}")],
                     [InlineKeyboardButton("◀️ Back to options", callback_data=f"domain_{domain}")],
                     [InlineKeyboardButton("🔍 Search another domain", callback_data="how_to_use")]
                 ]
@@ -489,6 +807,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     parse_mode=ParseMode.HTML
                 )
                 
+        except WhoisLookupError as e:
+            logger.warning(f"Lookup failed for {domain}: {str(e)}")
+            await show_lookup_failure(query, domain, e)
+        
         except Exception as e:
             logger.error(f"Error checking domain availability for {domain}: {str(e)}")
             await query.edit_message_text(text=f"Error checking domain availability: {str(e)}")
@@ -516,6 +838,9 @@ async def whois_domain(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # Update recent searches
     update_recent_searches(user_id, domain)
     
+    # Start fetching in the background while the user picks an option
+    start_prefetch(user_id, domain)
+    
     # Show options when domain is entered
     keyboard = [
         [InlineKeyboardButton("🔎 View WHOIS", callback_data=f"whois_{domain}")],
@@ -566,6 +891,122 @@ def is_valid_domain(domain: str) -> bool:
     pattern = r'^([a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}$'
     return bool(re.match(pattern, domain))
 
+# Common "error" or "rate limit" messages that shouldn't be interpreted as availability
+WHOIS_ERROR_PATTERNS = [
+    r'quota exceeded',
+    r'too many requests',
+    r'limit exceeded',
+    r'connection refused',
+    r'timeout',
+    r'error'
+]
+
+def has_whois_error_message(whois_output: str) -> bool:
+    """Check whether a WHOIS output contains an error or rate limit message."""
+    whois_lower = whois_output.lower()
+    return any(phrase in whois_lower for phrase in WHOIS_ERROR_PATTERNS)
+
+# Conditions for availability rules that depend on what follows the phrase
+def names_other_domain(whois_lower: str, end: int, domain_lower: str) -> bool:
+    """Check whether a "domain name: " field names something other than the queried domain."""
+    return not whois_lower.startswith(domain_lower, end)
+
+def names_queried_domain(whois_lower: str, end: int, domain_lower: str) -> bool:
+    """Check whether a "domain name: " field names the queried domain."""
+    return whois_lower.startswith(domain_lower, end)
+
+def status_not_free(whois_lower: str, end: int, domain_lower: str) -> bool:
+    """Check whether the rest of a status line says neither free nor available."""
+    line_end = whois_lower.find('\n', end)
+    rest = whois_lower[end:] if line_end == -1 else whois_lower[end:line_end]
+    return 'free' not in rest and 'available' not in rest
+
+# Availability rules as (phrase, verdict[, condition]) in order of precedence: the
+# earliest rule found anywhere in the output decides. A verdict of None is an error
+# message. A condition is called with (output, end of the phrase, domain) and must
+# hold for at least one occurrence of the phrase.
+COM_NET_AVAILABILITY_RULES = [
+    # Direct indicators of availability
+    ('no match for', True),
+    ('domain not found', True),
+    ('not found: ', True),
+    ('no data found', True),
+    ('no match found for', True),
+    ('not found in database', True),
+    ('not registered', True),
+    ('no entries found', True),
+    ('domain name: ', True, names_other_domain),      # Match domain name field with different domain
+    # Direct indicators of registration
+    ('domain name: ', False, names_queried_domain),   # This domain exists
+    ('domain status:', False, status_not_free),       # Has status and not free/available
+    ('registrar:', False),                            # Has registrar info
+    ('registration date:', False),                    # Has registration date
+    ('creation date:', False),                        # Has creation date
+    ('name server:', False)                           # Has name servers
+]
+
+AVAILABILITY_RULES = [(phrase, None) for phrase in WHOIS_ERROR_PATTERNS] + [
+    # Common phrases indicating a domain is not registered
+    ('no match', True),
+    ('not found', True),
+    ('no entries found', True),
+    ('no data found', True),
+    ('domain not found', True),
+    ('domain name is not registered', True),
+    ('domain is available', True),
+    ('domain not registered', True),
+    ('domain status: available', True),
+    ('status: free', True),
+    ('status: available', True),
+    ('no object found', True),
+    ('domain not exist', True),
+    ('domain available', True),
+    ('available for registration', True),
+    ('availability: available', True),
+    ('query: no match', True),
+    # Common unavailable domain indicators
+    ('creation date', False),
+    ('created:', False),
+    ('registrar:', False),
+    ('registrant', False),
+    ('registered on', False),
+    ('domain status: ok', False),
+    ('domain status: active', False),
+    ('status: ok', False),
+    ('status: active', False),
+    ('name server:', False)
+]
+
+def compile_availability_rules(rules: list) -> tuple:
+    """Turn availability rules into (index, phrase, condition) entries in precedence order.
+
+    A rule whose phrase contains an earlier unconditional rule's phrase can never
+    decide (wherever it matches, the earlier one does too), so it is left out.
+    """
+    compiled = []
+    for index, (phrase, _, *condition) in enumerate(rules):
+        if any(earlier in phrase for _, earlier, earlier_condition in compiled if earlier_condition is None):
+            continue
+        compiled.append((index, phrase, condition[0] if condition else None))
+    return tuple(compiled)
+
+COM_NET_AVAILABILITY_MATCHER = compile_availability_rules(COM_NET_AVAILABILITY_RULES)
+AVAILABILITY_MATCHER = compile_availability_rules(AVAILABILITY_RULES)
+
+def find_availability_rule(matcher: tuple, whois_lower: str, domain_lower: str):
+    """Return the index of the highest precedence rule found in the output, or None."""
+    for index, phrase, condition in matcher:
+        if phrase not in whois_lower:
+            continue
+        if condition is None:
+            return index
+        start = whois_lower.find(phrase)
+        while start != -1:
+            if condition(whois_lower, start + len(phrase), domain_lower):
+                return index
+            start = whois_lower.find(phrase, start + 1)
+    return None
+
 def check_domain_availability(whois_output: str, domain: str) -> bool:
     """
     Check if a domain is available based on the WHOIS output.
@@ -584,248 +1025,2096 @@ def check_domain_availability(whois_output: str, domain: str) -> bool:
     # Extract TLD from domain (.com, .net, etc.)
     tld = domain_lower.split('.')[-1] if '.' in domain_lower else ''
     
-    # Log the TLD for debugging
-    logger.info(f"Checking availability for domain with TLD: {tld}")
-    
     # Special handling for .com and .net TLDs
     if tld in ['com', 'net']:
-        # For .com and .net domains, check for these specific patterns
-        com_net_available_patterns = [
-            r'no match for',
-            r'domain not found',
-            r'not found: ',
-            r'no data found',
-            r'no match found for',
-            r'not found in database',
-            r'not registered',
-            r'no entries found',
-            r'domain name: (?!{})'.format(re.escape(domain_lower))  # Match domain name field with different domain
-        ]
-        
-        com_net_unavailable_patterns = [
-            r'domain name: {}'.format(re.escape(domain_lower)), # This domain exists
-            r'domain status:(?!.*(free|available))',      # Has status and not free/available
-            r'registrar:',                                # Has registrar info
-            r'registration date:',                         # Has registration date
-            r'creation date:',                            # Has creation date
-            r'name server:'                               # Has name servers
-        ]
-        
-        # Check for direct indicators of availability
-        for pattern in com_net_available_patterns:
-            if re.search(pattern, whois_lower):
-                logger.info(f"COM/NET domain appears available: pattern '{pattern}' found in output")
-                return True
-        
-        # Check for direct indicators of registration
-        for pattern in com_net_unavailable_patterns:
-            if re.search(pattern, whois_lower):
-                logger.info(f"COM/NET domain appears registered: pattern '{pattern}' found in output")
-                return False
+        index = find_availability_rule(COM_NET_AVAILABILITY_MATCHER, whois_lower, domain_lower)
+        if index is not None:
+            pattern, is_available = COM_NET_AVAILABILITY_RULES[index][:2]
+            state = "available" if is_available else "registered"
+            lookup_logger.debug(f"{domain_lower}: COM/NET domain appears {state}: pattern '{pattern}' found in output")
+            return is_available
                 
         # If the WHOIS response is very short, it might indicate availability
         if len(whois_output.strip()) < 100:
-            logger.info("Short COM/NET WHOIS output, likely available domain")
+            lookup_logger.debug(f"{domain_lower}: Short COM/NET WHOIS output, likely available domain")
             return True
             
         # For COM/NET: Default to AVAILABLE if we're not sure
         # This is different from the general approach because COM/NET WHOIS responses
         # are often very minimal for available domains
-        logger.info("COM/NET domain with ambiguous status, defaulting to AVAILABLE")
+        lookup_logger.debug(f"{domain_lower}: COM/NET domain with ambiguous status, defaulting to AVAILABLE")
         return True
     
     # General availability check for other TLDs
-    
-    # 1. Common phrases indicating a domain is not registered
-    available_patterns = [
-        r'no match',
-        r'not found',
-        r'no entries found',
-        r'no data found',
-        r'domain not found',
-        r'domain name is not registered',
-        r'domain is available',
-        r'domain not registered',
-        r'domain status: available',
-        r'status: free',
-        r'status: available',
-        r'no object found',
-        r'domain not exist',
-        r'domain available',
-        r'available for registration',
-        r'availability: available',
-        r'query: no match'
-    ]
-    
-    # 2. Check for common unavailable domain indicators
-    unavailable_patterns = [
-        r'creation date',
-        r'created:',
-        r'registrar:',
-        r'registrant',
-        r'registered on',
-        r'domain status: ok',
-        r'domain status: active',
-        r'status: ok',
-        r'status: active',
-        r'name server:'
-    ]
-    
-    # 3. Common "error" or "rate limit" messages that shouldn't be interpreted as availability
-    error_patterns = [
-        r'quota exceeded',
-        r'too many requests',
-        r'connection refused',
-        r'timeout',
-        r'error'
-    ]
-    
-    # First, check for error patterns - if found, we can't determine availability
-    for pattern in error_patterns:
-        if re.search(pattern, whois_lower):
+    index = find_availability_rule(AVAILABILITY_MATCHER, whois_lower, domain_lower)
+    if index is not None:
+        pattern, is_available = AVAILABILITY_RULES[index][:2]
+        if is_available is None:
             # If we find an error message, return False as we can't confirm availability
-            logger.warning(f"WHOIS error detected: pattern '{pattern}' found in output")
-            return False
-    
-    # Check for availability patterns
-    for pattern in available_patterns:
-        if re.search(pattern, whois_lower):
-            logger.info(f"Domain appears available: pattern '{pattern}' found in output")
-            return True
-    
-    # Check for definitive signs of registration
-    for pattern in unavailable_patterns:
-        if re.search(pattern, whois_lower):
-            logger.info(f"Domain appears registered: pattern '{pattern}' found in output")
+            lookup_logger.debug(f"{domain_lower}: WHOIS error detected: pattern '{pattern}' found in output")
             return False
+        state = "available" if is_available else "registered"
+        lookup_logger.debug(f"{domain_lower}: Domain appears {state}: pattern '{pattern}' found in output")
+        return is_available
     
     # Check output length - very short outputs often mean "no match" in some WHOIS servers
     if len(whois_output.strip()) < 50:
-        logger.info("Short WHOIS output, likely available domain")
+        lookup_logger.debug(f"{domain_lower}: Short WHOIS output, likely available domain")
         return True
     
     # Fallback logic: if a new/unknown WHOIS format, let's try to analyze it
     # If there are NOT many fields/lines, usually means domain is available
     lines = [line for line in whois_lower.split('\n') if line.strip()]
     if len(lines) < 5:
-        logger.info("Few output lines, likely available domain")
+        lookup_logger.debug(f"{domain_lower}: Few output lines, likely available domain")
         return True
         
     # Default to unavailable if we can't determine for sure
     # This is the safest approach for domains we're uncertain about
-    logger.info("Couldn't definitively determine domain status, defaulting to unavailable")
+    lookup_logger.debug(f"{domain_lower}: Couldn't definitively determine domain status, defaulting to unavailable")
     return False
 
-def format_whois_output(domain: str, raw_output: str) -> str:
+# Parsed WHOIS records
+# Tags the line classifier puts on each line, as bit flags
+LINE_EXPIRY = 1
+LINE_NAMESERVER = 2
+
+# Lines shown by the expiry and DNS views (matched against the lowercased line)
+WHOIS_EXPIRY_LINE_RE = re.compile(r'expiry|expir(?:ation|es).*?date|paid-till|valid\s?until|expires\s?on')
+WHOIS_NAMESERVER_LINE_RE = re.compile(r'name\s?server|nserver|dns')
+# JPRS (.jp) writes fields as "[Key]  value", optionally after a letter: "p. [Name Server]  ns1.example.jp"
+WHOIS_JPRS_FIELD_RE = re.compile(r'(?:[a-z]\. )?\[(\w[^\]]*)\]\s+(.*)')
+# ...and its state carries the expiry date: "[State]  Connected (2027/03/31)"
+WHOIS_JPRS_STATE_DATE_RE = re.compile(r'\((\d{4}/\d\d/\d\d)\)')
+
+# Field names (lowercased, before the colon) that carry the structured fields
+WHOIS_REGISTRAR_FIELDS = {"registrar", "sponsoring registrar", "registrar name"}
+WHOIS_STATUS_FIELDS = {"domain status", "status", "state"}
+WHOIS_CREATED_FIELDS = {
+    "creation date", "created", "created on", "registered on", "registered date",
+    "registration date", "registration time", "domain registration date"
+}
+WHOIS_EXPIRES_FIELDS = {
+    "registry expiry date", "registrar registration expiration date",
+    "paid-till", "valid until"
+}
+WHOIS_UPDATED_FIELDS = {
+    "updated date", "updated", "last updated", "last updated on", "last update", "last-update",
+    "last-updated", "last modified", "modified", "changed"
+}
+WHOIS_NAMESERVER_FIELDS = {
+    "name server", "name servers", "nameserver", "nameservers", "nserver", "domain nameservers"
+}
+WHOIS_FIELDS = (
+    WHOIS_REGISTRAR_FIELDS | WHOIS_STATUS_FIELDS | WHOIS_CREATED_FIELDS
+    | WHOIS_EXPIRES_FIELDS | WHOIS_UPDATED_FIELDS | WHOIS_NAMESERVER_FIELDS
+)
+
+# Date formats seen in WHOIS responses, tried in order; naive times are taken as UTC.
+# ISO 8601 goes through datetime.fromisoformat, which is far cheaper than strptime
+# (the strptime versions below it cover Pythons whose fromisoformat rejects "Z").
+WHOIS_ISO_DATE = "ISO 8601"
+WHOIS_DATE_FORMATS = [
+    WHOIS_ISO_DATE,
+    "%Y-%m-%dT%H:%M:%SZ",          # gTLDs, .ru paid-till
+    "%Y-%m-%dT%H:%M:%S.%fZ",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S%z",
+    "%Y-%m-%d %H:%M:%S %Z",
+    "%Y.%m.%d",
+    "%Y.%m.%d %H:%M:%S",
+    "%Y/%m/%d",
+    "%Y/%m/%d %H:%M:%S",
+    "%d-%b-%Y",                    # 13-Dec-2025 (.uk)
+    "%d-%b-%Y %H:%M:%S",
+    "%d.%m.%Y",
+    "%d.%m.%Y %H:%M:%S",
+    "%d/%m/%Y",
+    "%d %b %Y",
+    "%b %d %Y",
+    "%B %d %Y",
+    "%a %b %d %H:%M:%S %Z %Y",
+    "%Y%m%d"                       # 20250930 (.br)
+]
+
+WHOIS_DATE_SHAPE = str.maketrans("0123456789", "0000000000")
+WHOIS_DATE_FORMATS_MAX_SHAPES = 512
+
+class WhoisRecord:
+    """A WHOIS response parsed once into the fields the bot's views need."""
+    
+    __slots__ = (
+        "domain", "raw", "available", "status", "registrar", "created", "updated", "expires",
+        "nameservers", "lines", "tags"
+    )
+    
+    def __init__(self, domain: str, raw: str, available: bool, status: tuple, registrar: str,
+                 created, updated, expires, nameservers: tuple, lines: tuple, tags: tuple):
+        self.domain = domain
+        self.raw = raw
+        self.available = available
+        self.status = status
+        self.registrar = registrar
+        self.created = created
+        self.updated = updated
+        self.expires = expires
+        self.nameservers = nameservers
+        self.lines = lines
+        self.tags = tags
+    
+    def tagged_lines(self, tag: int) -> list:
+        """Return the (stripped) non-empty lines that carry a tag."""
+        return [line.strip() for line, tags in zip(self.lines, self.tags) if tags & tag]
+    
+    def days_remaining(self):
+        """Return the whole days left until the domain expires (negative once expired), or None."""
+        if self.expires is None:
+            return None
+        return (self.expires - datetime.now(timezone.utc)).days
+
+def parse_whois_date_as(value: str, date_format: str):
+    """Parse a date with one format and return it as a UTC datetime, or None."""
+    try:
+        if date_format == WHOIS_ISO_DATE:
+            parsed = datetime.fromisoformat(value)
+        else:
+            parsed = datetime.strptime(value, date_format)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+def normalize_whois_date(value: str):
+    """Turn a WHOIS date field value into a UTC datetime, or None if it isn't a known format.
+
+    The format that worked for a value is remembered by the value's shape, so a
+    registry's dates cost a single strptime call after the first one.
+    """
+    value = value.strip()
+    candidates = [value]
+    # Drop trailing notes such as "(YYYY-MM-DD)" or a timezone remark
+    if ' (' in value:
+        candidates.append(value.split(' (', 1)[0])
+    if ' ' in value:
+        candidates.append(value.split(None, 1)[0])
+    
+    for candidate in candidates:
+        shape = candidate.translate(WHOIS_DATE_SHAPE)
+        cached = whois_date_formats.get(shape)
+        if cached is not None:
+            parsed = parse_whois_date_as(candidate, cached)
+            if parsed is not None:
+                return parsed
+        
+        for date_format in WHOIS_DATE_FORMATS:
+            parsed = parse_whois_date_as(candidate, date_format)
+            if parsed is not None:
+                if len(whois_date_formats) < WHOIS_DATE_FORMATS_MAX_SHAPES:
+                    whois_date_formats[shape] = date_format
+                return parsed
+    return None
+
+def split_whois_field(line: str):
+    """Split a stripped "Key: value" line into (lowercased key, value), or return None.
+
+    Only a colon followed by whitespace (or ending the line) ends a key, so
+    times, URLs and IPv6 addresses in value lines aren't taken for fields.
+    """
+    if line[0] == '[' or line[1:4] == '. [':
+        match = WHOIS_JPRS_FIELD_RE.fullmatch(line)
+        if match:
+            return match.group(1).lower(), match.group(2)
+    colon = line.find(':')
+    if colon <= 0 or (colon + 1 < len(line) and line[colon + 1] not in ' \t'):
+        return None
+    return line[:colon].strip().lower(), line[colon + 1:].strip()
+
+def is_whois_field(key: str) -> bool:
+    """Check whether a field name carries one of the structured fields."""
+    return key in WHOIS_FIELDS or key.startswith("expir")
+
+def classify_whois_line(line_lower: str) -> int:
+    """Tag a lowercased WHOIS line as expiry and/or name server information."""
+    tags = 0
+    if WHOIS_EXPIRY_LINE_RE.search(line_lower):
+        tags |= LINE_EXPIRY
+    if WHOIS_NAMESERVER_LINE_RE.search(line_lower):
+        tags |= LINE_NAMESERVER
+    return tags
+
+def parse_whois_record(domain: str, whois_output: str, is_available: bool = None) -> WhoisRecord:
+    """Walk a WHOIS output once and collect everything the views and caches need."""
+    # The RDAP backend's answers are JSON, with the fields already structured
+    if is_rdap_output(whois_output):
+        return parse_rdap_record(domain, whois_output, is_available)
+    if is_available is None:
+        is_available = check_domain_availability(whois_output, domain)
+    
+    status, nameservers, lines, line_tags = [], [], [], []
+    registrar = created = updated = expires = None
+    # Some registries (.uk, .nl, .it, ...) put a field's values on the lines below its
+    # name ("Name servers:" or just "Nameservers"); block_key is that field until a
+    # blank line or another field at the same or a shallower indentation
+    block_key, block_indent = None, 0
+    
+    for line in whois_output.split('\n'):
+        stripped = line.strip()
+        if not stripped:
+            block_key = None
+            continue
+        lines.append(line)
+        line_tags.append(classify_whois_line(stripped.lower()))
+        
+        field = split_whois_field(stripped)
+        header = None if field else stripped.lower()
+        if block_key is not None and (field or header in WHOIS_FIELDS):
+            if len(line) - len(line.lstrip()) <= block_indent:
+                block_key = None
+        
+        if block_key is not None and (field is None or not is_whois_field(field[0])):
+            # A value of the block; a sub-field such as .it's "Organization:" counts as one too
+            key, value = block_key, field[1] if field else stripped
+        elif field is not None:
+            key, value = field
+            if not value:
+                block_key, block_indent = key, len(line) - len(line.lstrip())
+                continue
+        elif header in WHOIS_FIELDS:
+            block_key, block_indent = header, len(line) - len(line.lstrip())
+            continue
+        else:
+            continue
+        if not value:
+            continue
+        
+        if key in WHOIS_NAMESERVER_FIELDS:
+            nameservers.append(value.split()[0].lower().rstrip('.'))
+        elif key in WHOIS_STATUS_FIELDS:
+            # .ru lists several states on one line: "REGISTERED, DELEGATED, VERIFIED"
+            status.extend(part.split()[0] for part in value.split(',') if part.strip())
+            if expires is None and key == "state":
+                match = WHOIS_JPRS_STATE_DATE_RE.search(value)
+                if match:
+                    expires = normalize_whois_date(match.group(1))
+        elif key in WHOIS_REGISTRAR_FIELDS:
+            if registrar is None:
+                registrar = value
+        elif key in WHOIS_CREATED_FIELDS:
+            if created is None:
+                created = normalize_whois_date(value)
+        elif key in WHOIS_UPDATED_FIELDS:
+            if updated is None:
+                updated = normalize_whois_date(value)
+        elif key in WHOIS_EXPIRES_FIELDS or key.startswith("expir"):
+            if expires is None:
+                expires = normalize_whois_date(value)
+    
+    return WhoisRecord(
+        domain=domain,
+        raw=whois_output,
+        available=is_available,
+        status=tuple(dict.fromkeys(status)),
+        registrar=registrar,
+        created=created,
+        updated=updated,
+        expires=expires,
+        nameservers=tuple(dict.fromkeys(nameservers)),
+        lines=tuple(lines),
+        tags=tuple(line_tags)
+    )
+
+def format_whois_output(domain: str, record: "WhoisRecord") -> str:
     """Format the WHOIS output for better readability."""
     # Add a header
     formatted = f"🌐 <b>WHOIS Information for {escape_html(domain)}</b>\n\n"
     
+    # The parsed key facts first, then the full response
+    facts = []
+    if record.registrar:
+        facts.append(("Registrar", record.registrar))
+    for label, date in (("Created", record.created), ("Updated", record.updated), ("Expires", record.expires)):
+        if date is not None:
+            facts.append((label, date.strftime('%Y-%m-%d')))
+    if record.status:
+        facts.append(("Status", ", ".join(record.status)))
+    if record.nameservers:
+        facts.append(("Name servers", ", ".join(record.nameservers)))
+    for label, value in facts:
+        formatted += f"<b>{label}:</b> {escape_html(value)}\n"
+    if facts:
+        formatted += "\n"
+    
     # Instead of using <pre> tags which may cause issues with < and > in the text,
     # just escape each line and format with line breaks
-    lines = raw_output.split('\n')
-    for line in lines:
-        if line.strip():
-            formatted += f"{escape_html(line)}\n"
+    for line in record.lines:
+        formatted += f"{escape_html(line)}\n"
     
     # Add footer with timestamp
     formatted += f"\n<i>Retrieved at {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}</i>"
     
     return formatted
 
-def extract_expiry_date(domain: str, whois_output: str) -> str:
-    """Extract and format expiration date information from WHOIS output."""
+def extract_expiry_date(domain: str, record: "WhoisRecord") -> str:
+    """Format the expiration date lines of a parsed WHOIS record."""
     expiry_info = f"📅 <b>Expiration Date for {escape_html(domain)}</b>\n\n"
-    found = False
-    
-    # Common expiry date field patterns in WHOIS output
-    expiry_patterns = [
-        r'(?i)expir(y|ation|es).*?date',
-        r'(?i)registry(\s)?expiry(\s)?date',
-        r'(?i)paid-till',
-        r'(?i)valid(\s)?until',
-        r'(?i)expiry',
-        r'(?i)expires(\s)?on'
-    ]
+    expiry_lines = record.tagged_lines(LINE_EXPIRY)
     
-    lines = whois_output.split('\n')
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Check if this line contains expiry information
-        if any(re.search(pattern, line, re.IGNORECASE) for pattern in expiry_patterns):
-            found = True
-            expiry_info += f"{escape_html(line)}\n"
+    days = record.days_remaining()
+    if days is not None:
+        expires = record.expires.strftime('%Y-%m-%d')
+        if days >= 0:
+            expiry_info += f"<b>Expires {expires}</b> (in {days} days)\n\n"
+        else:
+            expiry_info += f"<b>Expired {expires}</b> ({-days} days ago)\n\n"
     
-    if not found:
+    for line in expiry_lines:
+        expiry_info += f"{escape_html(line)}\n"
+    
+    if not expiry_lines:
         expiry_info += "No expiration date information found in the WHOIS data."
     
     expiry_info += f"\n<i>Retrieved at {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}</i>"
     return expiry_info
 
-def extract_dns_info(domain: str, whois_output: str) -> str:
-    """Extract and format DNS server information from WHOIS output."""
+def extract_dns_info(domain: str, record: "WhoisRecord") -> str:
+    """Format the DNS server lines of a parsed WHOIS record."""
     dns_info = f"🌐 <b>DNS Information for {escape_html(domain)}</b>\n\n"
-    found = False
-    
-    # Common DNS field patterns in WHOIS output
-    dns_patterns = [
-        r'(?i)name(\s)?server',
-        r'(?i)nserver',
-        r'(?i)dns',
-        r'(?i)name(\s)?servers'
-    ]
     
-    lines = whois_output.split('\n')
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Check if this line contains DNS information
-        if any(re.search(pattern, line, re.IGNORECASE) for pattern in dns_patterns):
-            found = True
+    if record.nameservers:
+        dns_info += "<b>Name servers:</b>\n"
+        for nameserver in record.nameservers:
+            dns_info += f"• <code>{escape_html(nameserver)}</code>\n"
+    else:
+        # A layout the parser doesn't know - show every line that mentions name servers
+        dns_lines = record.tagged_lines(LINE_NAMESERVER)
+        for line in dns_lines:
             dns_info += f"{escape_html(line)}\n"
-    
-    if not found:
-        dns_info += "No DNS server information found in the WHOIS data."
+        
+        if not dns_lines:
+            dns_info += "No DNS server information found in the WHOIS data."
     
     dns_info += f"\n<i>Retrieved at {datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')}</i>"
     return dns_info
 
-def get_whois_info(domain: str) -> str:
-    """Get WHOIS information from the server using sshpass."""
+# Per-server rate limiting
+WHOIS_QUOTA_PATTERNS = re.compile(
+    r'quota exceeded|too many requests|rate limit exceeded|limit exceeded|limit reached|query rate',
+    re.IGNORECASE
+)
+
+def get_whois_rate_limiter(server: str) -> dict:
+    """Return the token bucket for an upstream WHOIS server, creating it if needed."""
+    limiter = whois_rate_limiters.get(server)
+    if limiter is None:
+        limiter = {
+            "tokens": float(WHOIS_RATE_BURST),
+            "updated": time.monotonic(),
+            "backoff": 0.0,
+            "blocked_until": 0.0
+        }
+        whois_rate_limiters[server] = limiter
+    return limiter
+
+async def acquire_whois_rate_limit(server: str) -> None:
+    """Wait in line until a query to this WHOIS server is allowed.
+
+    Each caller books the next free slot as soon as it arrives, so callers are
+    served in arrival order. If that slot is past the current lookup's deadline
+    (e.g. the server has us backing off for longer), WhoisRateLimitedError is
+    raised right away instead of holding a lookup worker until it times out.
+    """
+    limiter = get_whois_rate_limiter(server)
+    while True:
+        now = time.monotonic()
+        
+        # Refill the bucket for the time that passed (it stays empty during a backoff)
+        if now > limiter["updated"]:
+            limiter["tokens"] = min(
+                float(WHOIS_RATE_BURST),
+                limiter["tokens"] + (now - limiter["updated"]) * WHOIS_RATE_LIMIT
+            )
+            limiter["updated"] = now
+        
+        # Tokens below zero are slots already booked by earlier callers
+        tokens = limiter["tokens"] - 1
+        wait = limiter["updated"] - now + max(0.0, -tokens) / WHOIS_RATE_LIMIT
+        deadline = whois_lookup_deadline.get()
+        if deadline is not None and now + wait > deadline:
+            raise WhoisRateLimitedError(f"WHOIS server {server} is rate limited for another {wait:.1f}s")
+        
+        limiter["tokens"] = tokens
+        if wait <= 0:
+            return
+        blocked_until = limiter["blocked_until"]
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            # Give the unused slot back
+            limiter["tokens"] += 1
+            raise
+        
+        # A quota response while we waited cancelled every booking, so book again
+        if limiter["blocked_until"] == blocked_until:
+            return
+
+def report_whois_response(server: str, response: str) -> None:
+    """Adapt the backoff for a WHOIS server based on its latest response."""
+    limiter = get_whois_rate_limiter(server)
+    if WHOIS_QUOTA_PATTERNS.search(response):
+        # Double the backoff on every quota response, up to the maximum
+        limiter["backoff"] = min(WHOIS_BACKOFF_MAX, limiter["backoff"] * 2 or WHOIS_BACKOFF_INITIAL)
+        limiter["blocked_until"] = time.monotonic() + limiter["backoff"]
+        
+        # Start refilling from an empty bucket once the backoff is over
+        limiter["tokens"] = 0.0
+        limiter["updated"] = limiter["blocked_until"]
+        logger.warning(f"WHOIS server {server} reported a quota limit, backing off for {limiter['backoff']:.0f}s")
+    elif limiter["backoff"]:
+        # Recover gradually once the server answers normally again
+        limiter["backoff"] = limiter["backoff"] / 2 if limiter["backoff"] > WHOIS_BACKOFF_INITIAL else 0.0
+
+def whois_server_for_domain(domain: str) -> str:
+    """Return the registry WHOIS server the remote whois binary will query for a domain."""
+    tld = domain.lower().rsplit('.', 1)[-1]
+    entry = whois_routes.get(tld)
+    return entry["server"] if entry and entry.get("server") else f".{tld}"
+
+# WHOIS relay hosts
+def load_ssh_hosts() -> None:
+    """Load the WHOIS relay hosts from WHOIS_HOSTS, data/whois_hosts.json or SERVER_IP."""
+    global ssh_hosts
+    entries = None
     try:
-        # Check if root password is set
-        if not ROOT_PASSWORD:
-            return "Error: Server password is not configured. Please set the ROOT_PASSWORD environment variable."
-            
-        # Use sshpass to handle SSH password authentication
-        # Install sshpass with: apt-get install -y sshpass
-        cmd = [
-            'sshpass', 
-            '-p', ROOT_PASSWORD, 
-            'ssh', 
-            '-o', 'StrictHostKeyChecking=no', 
-            f'root@{SERVER_IP}', 
-            f'whois {domain}'
+        if WHOIS_HOSTS:
+            entries = json.loads(WHOIS_HOSTS)
+        elif os.path.exists(WHOIS_HOSTS_FILE):
+            with open(WHOIS_HOSTS_FILE, 'r') as f:
+                entries = json.load(f)
+    except Exception as e:
+        logger.error(f"Error loading WHOIS hosts: {e}")
+    if not entries:
+        entries = [{"host": SERVER_IP, "user": "root", "password": ROOT_PASSWORD}]
+    
+    ssh_hosts = []
+    for entry in entries:
+        if not entry.get("password"):
+            logger.warning(f"WHOIS host {entry.get('host')} has no password configured, skipping it")
+            continue
+        ssh_hosts.append({
+            "address": entry["host"],
+            "user": entry.get("user", "root"),
+            "password": entry["password"],
+            "weight": max(0.1, float(entry.get("weight", 1))),
+            "pool": [],
+            "pool_index": 0,
+            "outstanding": 0,
+            "failures": 0,
+            "eject_time": SSH_HOST_EJECT_TIME,
+            "ejected_until": 0.0,
+            "batch_pending": [],  # [(domain, future)] waiting for the next batch
+            "batch_task": None,
+            "running_batches": set()  # running batches (the event loop only keeps weak references)
+        })
+    logger.info(f"Loaded {len(ssh_hosts)} WHOIS relay hosts")
+
+def ssh_target(host: dict) -> str:
+    """Return the user@address ssh destination for a host."""
+    return f"{host['user']}@{host['address']}"
+
+# Build the common sshpass/ssh command prefix
+def ssh_base_command(host: dict) -> list:
+    """Return the sshpass/ssh command prefix used for every SSH invocation to a host."""
+    # Use sshpass to handle SSH password authentication
+    # Install sshpass with: apt-get install -y sshpass
+    return [
+        'sshpass',
+        '-p', host["password"],
+        'ssh',
+        '-o', 'StrictHostKeyChecking=no',
+        '-o', f'ConnectTimeout={int(WHOIS_CONNECT_TIMEOUT)}',
+    ]
+
+async def run_command(args: list, timeout: float = None) -> tuple:
+    """Run a command and return (returncode, stdout, stderr).
+
+    If the command takes longer than the timeout (or the caller is cancelled)
+    the whole process group is killed, so no sshpass/ssh/whois child is left behind.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except BaseException as e:
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        if isinstance(e, asyncio.TimeoutError):
+            raise WhoisTimeoutError(f"{os.path.basename(args[0])} timed out after {timeout:.0f}s") from None
+        raise
+    return (
+        process.returncode,
+        stdout.decode('utf-8', errors='replace'),
+        stderr.decode('utf-8', errors='replace')
+    )
+
+# Open the multiplexed master connection for a pool slot
+async def connect_ssh_slot(host: dict, slot: dict) -> bool:
+    """Start an authenticated ControlMaster connection for a pool slot."""
+    async with slot["lock"]:
+        # Another caller may have reconnected the slot while we waited
+        if slot["healthy"]:
+            return True
+        
+        cmd = ssh_base_command(host) + [
+            '-o', 'ControlMaster=yes',
+            '-o', f'ControlPath={slot["path"]}',
+            '-o', 'ControlPersist=yes',
+            '-o', 'ServerAliveInterval=30',
+            '-N', '-f',
+            ssh_target(host)
         ]
+        try:
+            returncode, _, stderr = await run_command(cmd, timeout=WHOIS_CONNECT_TIMEOUT * 2)
+        except Exception as e:
+            logger.error(f"Failed to open SSH connection for pool slot {slot['path']}: {e}")
+            return False
         
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True
+        slot["healthy"] = returncode == 0
+        if slot["healthy"]:
+            logger.info(f"SSH pool slot connected: {slot['path']}")
+        else:
+            logger.error(f"SSH pool slot failed to connect: {stderr.strip()}")
+        return slot["healthy"]
+
+async def check_ssh_slot(host: dict, slot: dict) -> bool:
+    """Ask the master connection of a pool slot whether it is still alive."""
+    cmd = ['ssh', '-o', f'ControlPath={slot["path"]}', '-O', 'check', ssh_target(host)]
+    try:
+        returncode, _, _ = await run_command(cmd, timeout=WHOIS_CONNECT_TIMEOUT)
+    except Exception as e:
+        logger.error(f"SSH health check failed for {slot['path']}: {e}")
+        returncode = -1
+    slot["healthy"] = returncode == 0
+    return slot["healthy"]
+
+def init_ssh_pool(host: dict) -> None:
+    """Create the pool slots of a host (without connecting them)."""
+    if host["pool"]:
+        return
+    os.makedirs(SSH_CONTROL_DIR, mode=0o700, exist_ok=True)
+    host["pool"] = [
+        {
+            "path": os.path.join(SSH_CONTROL_DIR, f"{host['address']}-{i}.sock"),
+            "healthy": False,
+            "lock": asyncio.Lock()
+        }
+        for i in range(SSH_POOL_SIZE)
+    ]
+
+async def acquire_ssh_slot(host: dict) -> dict:
+    """Pick the host's next pool slot (round robin), reconnecting it if needed."""
+    init_ssh_pool(host)
+    pool = host["pool"]
+    
+    # Prefer a healthy slot, starting from the round robin position
+    for _ in range(len(pool)):
+        slot = pool[host["pool_index"] % len(pool)]
+        host["pool_index"] += 1
+        if slot["healthy"]:
+            return slot
+    
+    # No healthy slot available - reconnect the next one in line
+    slot = pool[host["pool_index"] % len(pool)]
+    host["pool_index"] += 1
+    await connect_ssh_slot(host, slot)
+    return slot
+
+def pick_ssh_host() -> dict:
+    """Pick the host with the fewest outstanding requests relative to its weight.
+
+    Ejected hosts are skipped until their ejection ends; if every host is
+    ejected, the one closest to coming back is used.
+    """
+    now = time.monotonic()
+    candidates = [host for host in ssh_hosts if host["ejected_until"] <= now]
+    if not candidates:
+        return min(ssh_hosts, key=lambda host: host["ejected_until"])
+    return min(candidates, key=lambda host: (host["outstanding"] + 1) / host["weight"])
+
+def record_ssh_host_result(host: dict, ok: bool) -> None:
+    """Track host health and eject it after repeated failures."""
+    if ok:
+        if host["failures"] or host["ejected_until"]:
+            logger.info(f"WHOIS host {host['address']} is healthy again")
+        host["failures"] = 0
+        host["eject_time"] = SSH_HOST_EJECT_TIME
+        host["ejected_until"] = 0.0
+        return
+    
+    host["failures"] += 1
+    if host["failures"] >= SSH_HOST_EJECT_THRESHOLD:
+        host["ejected_until"] = time.monotonic() + host["eject_time"]
+        logger.warning(
+            f"WHOIS host {host['address']} failed {host['failures']} times in a row, "
+            f"ejecting it for {host['eject_time']:.0f}s"
         )
+        # Keep it out longer every time it fails again
+        host["eject_time"] = min(host["eject_time"] * 2, SSH_HOST_EJECT_TIME * 16)
+
+async def probe_ssh_host(host: dict) -> None:
+    """Check a host's pool slots and reconnect dead ones; re-admit ejected hosts that answer."""
+    init_ssh_pool(host)
+    healthy = False
+    for slot in host["pool"]:
+        if await check_ssh_slot(host, slot):
+            healthy = True
+            continue
+        logger.warning(f"SSH pool slot {slot['path']} is down, reconnecting")
+        if await connect_ssh_slot(host, slot):
+            healthy = True
+    
+    if host["ejected_until"] and healthy:
+        record_ssh_host_result(host, True)
+
+async def ssh_health_check_loop() -> None:
+    """Periodically probe every host and reconnect dead pool slots."""
+    while True:
+        await asyncio.sleep(SSH_HEALTH_CHECK_INTERVAL)
+        await asyncio.gather(*(probe_ssh_host(host) for host in ssh_hosts))
+
+async def warm_up_ssh_pool() -> None:
+    """Connect all pool slots of every host and start the health check loop."""
+    global ssh_health_task
+    if not ssh_hosts:
+        load_ssh_hosts()
+    if not ssh_hosts:
+        logger.warning("No WHOIS host with a password is configured, skipping SSH pool warm-up")
+        return
+    
+    for host in ssh_hosts:
+        init_ssh_pool(host)
+    results = await asyncio.gather(*(
+        connect_ssh_slot(host, slot) for host in ssh_hosts for slot in host["pool"]
+    ))
+    logger.info(f"SSH pool warmed up: {sum(results)}/{len(results)} connections ready on {len(ssh_hosts)} hosts")
+    
+    if ssh_health_task is None:
+        ssh_health_task = asyncio.create_task(ssh_health_check_loop())
+
+async def close_ssh_pool() -> None:
+    """Stop the health check loop and close all master connections."""
+    global ssh_health_task
+    if ssh_health_task is not None:
+        ssh_health_task.cancel()
+        ssh_health_task = None
+    
+    for host in ssh_hosts:
+        for slot in host["pool"]:
+            cmd = ['ssh', '-o', f'ControlPath={slot["path"]}', '-O', 'exit', ssh_target(host)]
+            try:
+                await run_command(cmd, timeout=WHOIS_CONNECT_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Error closing SSH pool slot {slot['path']}: {e}")
+            slot["healthy"] = False
+
+def ssh_hosts_summary() -> str:
+    """Return a short human readable summary of the relay hosts."""
+    now = time.monotonic()
+    parts = []
+    for host in ssh_hosts:
+        state = "ejected" if host["ejected_until"] > now else f"{host['outstanding']} outstanding"
+        parts.append(f"{host['address']} ({state})")
+    return ", ".join(parts) if parts else "none"
+
+# Batched remote WHOIS execution
+def build_ssh_batch_script(domains: list, marker: str, timeout: float) -> str:
+    """Build a remote shell script that runs whois for every domain in parallel.
+
+    Each result is framed as "<marker> BEGIN <i>" ... "<marker> END <i> <exit code>"
+    so the combined output can be split back into per-domain parts. Every whois
+    run has its own timeout, so a slow registry only fails its own domain (with
+    exit code SSH_BATCH_TIMEOUT_EXIT_CODE).
+    """
+    lines = ['t=$(mktemp -d)']
+    for i, domain in enumerate(domains):
+        lines.append(f'(timeout {timeout:g} whois {shlex.quote(domain)} >"$t/{i}" 2>&1; echo $? >"$t/{i}.rc") &')
+    lines.append('wait')
+    for i in range(len(domains)):
+        lines.append(f'echo "{marker} BEGIN {i}"; cat "$t/{i}"; echo; echo "{marker} END {i} $(cat "$t/{i}.rc")"')
+    lines.append('rm -rf "$t"')
+    return "\n".join(lines)
+
+def parse_ssh_batch_output(stdout: str, marker: str) -> dict:
+    """Split framed batch output into {index: (exit code, output)}."""
+    pattern = re.compile(
+        rf'^{re.escape(marker)} BEGIN (\d+)\n(.*?)\n^{re.escape(marker)} END \1 (\d+)$',
+        re.DOTALL | re.MULTILINE
+    )
+    return {
+        int(match.group(1)): (int(match.group(3)), match.group(2))
+        for match in pattern.finditer(stdout)
+    }
+
+async def run_ssh_batch(host: dict, batch: list) -> None:
+    """Run one remote session for a batch of domains and resolve each caller's future."""
+    domains = [domain for domain, _ in batch]
+    marker = f"@@WHOIS-{secrets.token_hex(8)}@@"
+    slot = None
+    try:
+        slot = await acquire_ssh_slot(host)
+        cmd = ssh_base_command(host) + [
+            '-o', f'ControlPath={slot["path"]}',
+            '-o', 'ControlMaster=no',
+            ssh_target(host),
+            build_ssh_batch_script(domains, marker, WHOIS_READ_TIMEOUT)
+        ]
+        # The remote whois runs time out on their own; this only catches a stuck session
+        returncode, stdout, stderr = await run_command(cmd, timeout=WHOIS_READ_TIMEOUT + WHOIS_CONNECT_TIMEOUT)
+    except Exception as e:
+        # A hung session usually means the master connection is stuck
+        if isinstance(e, WhoisTimeoutError) and slot is not None:
+            slot["healthy"] = False
+        record_ssh_host_result(host, False)
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    
+    # Exit code 255 means ssh itself failed, so the master is probably gone; missing
+    # frames mean the session broke off. A failing whois run is the registry's business.
+    results = parse_ssh_batch_output(stdout, marker)
+    session_ok = returncode != 255 and len(results) == len(batch)
+    if not session_ok:
+        slot["healthy"] = False
+    record_ssh_host_result(host, session_ok)
+    for i, (domain, future) in enumerate(batch):
+        if future.done():
+            continue
+        if i not in results:
+            future.set_result(f"Error executing WHOIS command: {stderr}")
+            continue
         
-        if result.returncode != 0:
-            return f"Error executing WHOIS command: {result.stderr}"
+        exit_code, output = results[i]
+        if exit_code == SSH_BATCH_TIMEOUT_EXIT_CODE:
+            future.set_exception(WhoisTimeoutError(f"whois {domain} timed out after {WHOIS_READ_TIMEOUT:.0f}s on {host['address']}"))
+        elif exit_code != 0:
+            future.set_result(f"Error executing WHOIS command: {output}")
+        else:
+            future.set_result(output if output.strip() else "No WHOIS information found.")
+
+async def flush_ssh_batches(host: dict) -> None:
+    """Wait for the batch window to fill, then send the host's pending domains."""
+    pending = host["batch_pending"]
+    try:
+        await asyncio.sleep(SSH_BATCH_WINDOW)
+        while pending:
+            batch = pending[:SSH_BATCH_MAX_SIZE]
+            del pending[:SSH_BATCH_MAX_SIZE]
+            
+            # Drop callers that gave up while waiting for the window
+            batch = [(domain, future) for domain, future in batch if not future.done()]
+            if batch:
+                task = asyncio.create_task(run_ssh_batch(host, batch))
+                host["running_batches"].add(task)
+                task.add_done_callback(host["running_batches"].discard)
+    finally:
+        host["batch_task"] = None
+
+async def get_whois_info_ssh(domain: str) -> str:
+    """Get WHOIS information from a relay host using sshpass.
+
+    Lookups are spread over the relay hosts by least outstanding requests.
+    Lookups for the same host arriving within SSH_BATCH_WINDOW of each other
+    share one remote session over a pooled, multiplexed master connection, so
+    a burst pays for a single channel and the event loop keeps serving other
+    users meanwhile.
+    """
+    if not ssh_hosts:
+        load_ssh_hosts()
+    
+    # Check if a host with a password is configured
+    if not ssh_hosts:
+        return "Error: Server password is not configured. Please set the ROOT_PASSWORD environment variable."
+    
+    host = pick_ssh_host()
+    host["outstanding"] += 1
+    try:
+        # The remote whois binary talks to the registry from this host's IP,
+        # so each host has its own quota with every registry
+        limiter_key = f"{whois_server_for_domain(domain)}@{host['address']}"
+        await acquire_whois_rate_limit(limiter_key)
         
-        return result.stdout if result.stdout else "No WHOIS information found."
+        future = asyncio.get_running_loop().create_future()
+        host["batch_pending"].append((domain, future))
+        if host["batch_task"] is None:
+            host["batch_task"] = asyncio.create_task(flush_ssh_batches(host))
+        
+        output = await future
+        if not is_whois_error(output):
+            report_whois_response(limiter_key, output)
+        return output
     
+    except WhoisLookupError:
+        raise
     except Exception as e:
         return f"Failed to execute WHOIS command: {str(e)}"
+    finally:
+        host["outstanding"] -= 1
+
+# Referral lines: IANA "refer:"/"whois:", registry "Registrar WHOIS Server:", ARIN-style "ReferralServer:"
+WHOIS_REFERRAL_RE = re.compile(
+    r'^\s*(?:refer|whois|registrar whois server|referralserver):[ \t]*(?:r?whois://)?([a-z0-9.\-]+)',
+    re.IGNORECASE | re.MULTILINE
+)
+
+def find_whois_referral(response: str, current_server: str) -> str:
+    """Return the WHOIS server a response refers to, or None."""
+    for match in WHOIS_REFERRAL_RE.finditer(response):
+        server = match.group(1).strip('.').lower()
+        if server and server != current_server.lower():
+            return server
+    return None
+
+async def query_whois_server(server: str, query: str) -> str:
+    """Send one RFC 3912 query to a WHOIS server and return its response."""
+    await acquire_whois_rate_limit(server)
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(server, WHOIS_PORT),
+        timeout=WHOIS_CONNECT_TIMEOUT
+    )
+    try:
+        writer.write(f"{query}\r\n".encode('utf-8'))
+        await asyncio.wait_for(writer.drain(), timeout=WHOIS_READ_TIMEOUT)
+        
+        # Read until the server closes the connection, but never more than the limit
+        chunks = []
+        received = 0
+        while received < WHOIS_MAX_RESPONSE_BYTES:
+            chunk = await asyncio.wait_for(reader.read(4096), timeout=WHOIS_READ_TIMEOUT)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            received += len(chunk)
+        
+        response = b"".join(chunks)[:WHOIS_MAX_RESPONSE_BYTES].decode('utf-8', errors='replace')
+        report_whois_response(server, response)
+        return response
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+# TLD routing table
+def load_whois_routes():
+    """Load the seed TLD -> WHOIS server routes, then the learned ones on top, from files if exist."""
+    global whois_routes, whois_learned_routes
+    for path in (WHOIS_SERVERS_FILE, WHOIS_ROUTES_FILE):
+        try:
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    routes = json.load(f)
+                whois_routes.update(routes)
+                if path == WHOIS_ROUTES_FILE:
+                    whois_learned_routes = routes
+                logger.info(f"Loaded {len(routes)} WHOIS routes from {os.path.basename(path)}")
+        except Exception as e:
+            logger.error(f"Error loading WHOIS routes from {path}: {e}")
+
+def save_whois_routes():
+    """Save the learned WHOIS routes to file (the seed file is never rewritten)."""
+    try:
+        # Refreshes finishing together save from worker threads, one at a time
+        with whois_routes_lock:
+            routes = dict(whois_learned_routes)
+            with open(WHOIS_ROUTES_FILE, 'w') as f:
+                json.dump(routes, f, indent=2, sort_keys=True)
+    except Exception as e:
+        logger.error(f"Error saving WHOIS routes: {e}")
+
+async def refresh_whois_route(tld: str) -> str:
+    """Ask IANA which WHOIS server handles a TLD and store the answer."""
+    try:
+        response = await query_whois_server(WHOIS_IANA_SERVER, tld)
+    except (asyncio.TimeoutError, OSError, WhoisRateLimitedError) as e:
+        logger.warning(f"Could not refresh WHOIS route for .{tld}: {e!r}")
+        entry = whois_routes.get(tld)
+        return entry["server"] if entry else ""
+    
+    # An empty server means IANA knows no WHOIS server for this TLD
+    server = find_whois_referral(response, WHOIS_IANA_SERVER) or ""
+    whois_routes[tld] = whois_learned_routes[tld] = {"server": server, "updated": int(time.time())}
+    await asyncio.to_thread(save_whois_routes)
+    logger.info(f"WHOIS route for .{tld} refreshed: {server or 'none'}")
+    return server
+
+async def resolve_whois_server(tld: str) -> str:
+    """Return the WHOIS server for a TLD, refreshing stale entries lazily.
+
+    Stale entries are still used while a refresh runs in the background;
+    only unknown TLDs wait for the IANA round trip.
+    """
+    entry = whois_routes.get(tld)
+    
+    # Share one refresh per TLD between concurrent callers
+    task = whois_route_refreshes.get(tld)
+    if task is None and (entry is None or time.time() - entry.get("updated", 0) > WHOIS_ROUTE_TTL):
+        task = asyncio.create_task(refresh_whois_route(tld))
+        whois_route_refreshes[tld] = task
+        task.add_done_callback(lambda _: whois_route_refreshes.pop(tld, None))
+    
+    if entry is not None:
+        return entry["server"]
+    return await asyncio.shield(task)
+
+async def get_whois_info_native(domain: str) -> str:
+    """Get WHOIS information by speaking RFC 3912 directly, following referrals."""
+    tld = domain.lower().rsplit('.', 1)[-1]
+    server = await resolve_whois_server(tld) or WHOIS_IANA_SERVER
+    responses = []
+    visited = set()
+    
+    try:
+        for _ in range(WHOIS_MAX_REFERRALS + 1):
+            visited.add(server)
+            try:
+                response = await query_whois_server(server, domain)
+            except (asyncio.TimeoutError, OSError, WhoisRateLimitedError) as e:
+                # Keep whatever the previous server told us if a referral fails
+                if responses:
+                    logger.warning(f"WHOIS referral to {server} failed for {domain}: {e!r}")
+                    break
+                if isinstance(e, WhoisRateLimitedError):
+                    raise
+                if isinstance(e, asyncio.TimeoutError):
+                    raise WhoisTimeoutError(f"WHOIS server {server} did not answer in time") from None
+                return f"Error querying WHOIS server {server}: {e!r}"
+            
+            # The IANA answer only tells us where to go next, so don't show it
+            if server != WHOIS_IANA_SERVER:
+                responses.append(response)
+            
+            referral = find_whois_referral(response, server)
+            if not referral or referral in visited:
+                if not responses:
+                    responses.append(response)
+                break
+            server = referral
+        
+        output = "\n".join(r.strip() for r in responses if r.strip())
+        return output if output else "No WHOIS information found."
+    
+    except WhoisLookupError:
+        raise
+    except Exception as e:
+        return f"Failed to execute WHOIS query: {str(e)}"
+
+# Lookup backends
+def fixture_path(directory: str, domain: str) -> str:
+    """Return the file a domain's WHOIS fixture is stored in."""
+    return os.path.join(directory, f"{normalize_domain(domain)}.txt")
+
+# RDAP event actions and the WHOIS field each one is shown as
+RDAP_EVENT_FIELDS = [
+    ("registration", "Creation Date"),
+    ("last changed", "Updated Date"),
+    ("expiration", "Registry Expiry Date"),
+]
+# RFC 9083 error response body the RDAP backend answers with when a domain isn't registered
+RDAP_NOT_FOUND = {"errorCode": 404, "title": "Not Found"}
+
+def rdap_entity_name(entity: dict) -> str:
+    """Return the formatted name ("fn") from an RDAP entity's vCard, if any."""
+    vcard = entity.get("vcardArray") or []
+    if len(vcard) == 2:
+        for field in vcard[1]:
+            if field and field[0] == "fn" and len(field) > 3:
+                return str(field[3])
+    return entity.get("handle", "")
+
+def is_rdap_output(whois_output: str) -> bool:
+    """Check whether a lookup result is an RDAP JSON answer rather than WHOIS text."""
+    return whois_output.startswith('{')
+
+def parse_rdap_record(domain: str, rdap_output: str, is_available: bool = None) -> WhoisRecord:
+    """Build a record straight from an RDAP answer: 404 is available, the rest is read from the JSON."""
+    data = json.loads(rdap_output)
+    if is_available is None:
+        is_available = data.get("errorCode") == 404
+    if is_available:
+        return WhoisRecord(
+            domain=domain, raw=rdap_output, available=True, status=(), registrar=None,
+            created=None, updated=None, expires=None, nameservers=(), lines=(), tags=()
+        )
+    
+    registrar = None
+    for entity in data.get("entities") or []:
+        if "registrar" in (entity.get("roles") or []):
+            registrar = rdap_entity_name(entity) or None
+            break
+    
+    events = {event.get("eventAction"): event.get("eventDate") for event in data.get("events") or []}
+    created, updated, expires = (
+        normalize_whois_date(events[action]) if events.get(action) else None
+        for action in ("registration", "last changed", "expiration")
+    )
+    nameservers = [
+        nameserver["ldhName"].lower().rstrip('.')
+        for nameserver in data.get("nameservers") or [] if nameserver.get("ldhName")
+    ]
+    
+    # The WHOIS view shows the answer as "Field: value" lines
+    lines = tuple(format_rdap_domain(data, domain).splitlines())
+    return WhoisRecord(
+        domain=domain,
+        raw=rdap_output,
+        available=False,
+        status=tuple(dict.fromkeys(data.get("status") or [])),
+        registrar=registrar,
+        created=created,
+        updated=updated,
+        expires=expires,
+        nameservers=tuple(dict.fromkeys(nameservers)),
+        lines=lines,
+        tags=tuple(classify_whois_line(line.lower()) for line in lines)
+    )
+
+def format_rdap_domain(data: dict, domain: str) -> str:
+    """Render an RDAP domain object as WHOIS-style "Field: value" lines for display."""
+    lines = [f"Domain Name: {(data.get('ldhName') or domain).upper()}"]
+    
+    for entity in data.get("entities") or []:
+        if "registrar" in (entity.get("roles") or []):
+            lines.append(f"Registrar: {rdap_entity_name(entity)}")
+            for public_id in entity.get("publicIds") or []:
+                lines.append(f"Registrar IANA ID: {public_id.get('identifier', '')}")
+    
+    for status in data.get("status") or []:
+        lines.append(f"Domain Status: {status}")
+    
+    events = {event.get("eventAction"): event.get("eventDate") for event in data.get("events") or []}
+    for action, field in RDAP_EVENT_FIELDS:
+        if events.get(action):
+            lines.append(f"{field}: {events[action]}")
+    
+    for nameserver in data.get("nameservers") or []:
+        if nameserver.get("ldhName"):
+            lines.append(f"Name Server: {nameserver['ldhName'].upper()}")
+    
+    secure_dns = data.get("secureDNS") or {}
+    if "delegationSigned" in secure_dns:
+        lines.append(f"DNSSEC: {'signedDelegation' if secure_dns['delegationSigned'] else 'unsigned'}")
+    
+    return "\n".join(lines) + "\n"
+
+class WhoisBackend:
+    """A way of fetching raw WHOIS text for a domain.
+
+    lookup() returns the WHOIS output (the JSON answer for RDAP), or an error message
+    starting with one of WHOIS_ERROR_PREFIXES; it may raise WhoisTimeoutError or
+    WhoisRateLimitedError.
+    """
+    name = None
+    
+    def circuit_key(self, domain: str) -> str:
+        """Return the circuit breaker a lookup of this domain counts against."""
+        return f"{self.name}:{whois_server_for_domain(domain)}"
+    
+    async def start(self) -> None:
+        """Prepare connections when the bot starts."""
+    
+    async def close(self) -> None:
+        """Release connections when the bot stops."""
+    
+    async def lookup(self, domain: str) -> str:
+        raise NotImplementedError
+
+class SSHBackend(WhoisBackend):
+    """Run the whois binary on the relay hosts over pooled, batched SSH sessions.
+
+    Its circuits are per registry like the other backends'; a failing relay host
+    is taken out of rotation on its own by the pool's host ejection.
+    """
+    name = "ssh"
+    
+    async def start(self) -> None:
+        await warm_up_ssh_pool()
+    
+    async def close(self) -> None:
+        await close_ssh_pool()
+    
+    async def lookup(self, domain: str) -> str:
+        return await get_whois_info_ssh(domain)
+
+class LocalBackend(WhoisBackend):
+    """Run the whois binary installed on this machine."""
+    name = "local"
+    
+    async def lookup(self, domain: str) -> str:
+        server = whois_server_for_domain(domain)
+        await acquire_whois_rate_limit(server)
+        try:
+            returncode, stdout, stderr = await run_command(['whois', domain], timeout=WHOIS_READ_TIMEOUT)
+        except WhoisTimeoutError:
+            raise
+        except Exception as e:
+            return f"Failed to execute WHOIS command: {str(e)}"
+        
+        if returncode != 0:
+            return f"Error executing WHOIS command: {stderr or stdout}"
+        
+        report_whois_response(server, stdout)
+        return stdout if stdout else "No WHOIS information found."
+
+class NativeBackend(WhoisBackend):
+    """Speak RFC 3912 to the registry servers directly."""
+    name = "native"
+    
+    async def lookup(self, domain: str) -> str:
+        return await get_whois_info_native(domain)
+
+class FixtureBackend(WhoisBackend):
+    """Replay saved WHOIS outputs from WHOIS_FIXTURES_DIR (no network needed)."""
+    name = "fixture"
+    
+    async def lookup(self, domain: str) -> str:
+        # Optionally pretend to be a real backend, e.g. for benchmarks
+        if WHOIS_FIXTURE_DELAY:
+            await asyncio.sleep(WHOIS_FIXTURE_DELAY)
+        
+        path = fixture_path(WHOIS_FIXTURES_DIR, domain)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            # Unknown domains look like a registry "no match" answer
+            return f'No match for "{domain.upper()}".'
+        except Exception as e:
+            return f"Error reading WHOIS fixture {path}: {e}"
+
+class RDAPBackend(WhoisBackend):
+    """Query registries over RDAP (RFC 9082/9083) using pooled HTTP connections.
+
+    The JSON answer is passed on as the lookup output and parse_rdap_record reads
+    the verdict, dates and name servers straight from it; an HTTP 404 becomes an
+    RFC 9083 "not found" error object, i.e. available. TLDs without an RDAP
+    service are passed to RDAP_FALLBACK_BACKEND.
+    """
+    name = "rdap"
+    
+    def __init__(self):
+        self.client = None
+        self.servers = {}  # TLD -> RDAP base URL
+        self.servers_updated = 0
+        self.bootstrap_lock = asyncio.Lock()
+    
+    async def start(self) -> None:
+        self.get_client()
+        await asyncio.to_thread(self.load_servers)
+        await self.refresh_servers()
+        if RDAP_FALLBACK_BACKEND != self.name:
+            await get_whois_backend(RDAP_FALLBACK_BACKEND).start()
+    
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+    
+    def get_client(self) -> httpx.AsyncClient:
+        """Return the shared HTTP client, creating it on first use."""
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=httpx.Timeout(WHOIS_READ_TIMEOUT, connect=WHOIS_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=RDAP_MAX_CONNECTIONS,
+                    max_keepalive_connections=RDAP_MAX_CONNECTIONS
+                ),
+                headers={"Accept": "application/rdap+json"},
+                follow_redirects=True
+            )
+        return self.client
+    
+    async def get(self, url: str) -> httpx.Response:
+        """GET a URL with the shared client, logging the request as per-lookup detail."""
+        active = rdap_request_active.set(True)
+        try:
+            return await self.get_client().get(url)
+        finally:
+            rdap_request_active.reset(active)
+    
+    def load_servers(self) -> None:
+        """Load the cached RDAP bootstrap table from file if exists."""
+        try:
+            if os.path.exists(RDAP_SERVERS_FILE):
+                with open(RDAP_SERVERS_FILE, 'r') as f:
+                    data = json.load(f)
+                self.servers = data["servers"]
+                self.servers_updated = data["updated"]
+                logger.info(f"Loaded {len(self.servers)} RDAP servers from file")
+        except Exception as e:
+            logger.error(f"Error loading RDAP servers: {e}")
+    
+    def save_servers(self) -> None:
+        """Save the RDAP bootstrap table to file."""
+        try:
+            with open(RDAP_SERVERS_FILE, 'w') as f:
+                json.dump({"updated": self.servers_updated, "servers": self.servers}, f)
+        except Exception as e:
+            logger.error(f"Error saving RDAP servers: {e}")
+    
+    async def refresh_servers(self) -> None:
+        """Download the IANA RDAP bootstrap file when the cached copy is stale."""
+        async with self.bootstrap_lock:
+            if self.servers and time.time() - self.servers_updated < WHOIS_ROUTE_TTL:
+                return
+            try:
+                response = await self.get(RDAP_BOOTSTRAP_URL)
+                response.raise_for_status()
+                servers = {}
+                for tlds, urls in response.json()["services"]:
+                    # Prefer HTTPS when a registry lists several URLs
+                    url = sorted(urls, key=lambda u: not u.startswith("https"))[0]
+                    for tld in tlds:
+                        servers[tld.lower()] = url if url.endswith('/') else url + '/'
+            except Exception as e:
+                logger.warning(f"Could not refresh the RDAP bootstrap table: {e!r}")
+                return
+            
+            self.servers = servers
+            self.servers_updated = int(time.time())
+            await asyncio.to_thread(self.save_servers)
+            logger.info(f"RDAP bootstrap table refreshed: {len(servers)} TLDs")
+    
+    def circuit_key(self, domain: str) -> str:
+        base_url = self.servers.get(domain.lower().rsplit('.', 1)[-1])
+        if base_url is None:
+            return get_whois_backend(RDAP_FALLBACK_BACKEND).circuit_key(domain)
+        return f"{self.name}:{httpx.URL(base_url).host}"
+    
+    async def lookup(self, domain: str) -> str:
+        tld = domain.lower().rsplit('.', 1)[-1]
+        if not self.servers or time.time() - self.servers_updated >= WHOIS_ROUTE_TTL:
+            await self.refresh_servers()
+        
+        base_url = self.servers.get(tld)
+        if base_url is None:
+            return await get_whois_backend(RDAP_FALLBACK_BACKEND).lookup(domain)
+        
+        host = httpx.URL(base_url).host
+        await acquire_whois_rate_limit(host)
+        try:
+            response = await self.get(f"{base_url}domain/{domain}")
+        except httpx.TimeoutException:
+            raise WhoisTimeoutError(f"RDAP server {host} did not answer in time") from None
+        except httpx.HTTPError as e:
+            return f"Error querying RDAP server {host}: {e!r}"
+        
+        # 404 is RDAP's "no such object" - the domain is not registered
+        if response.status_code == 404:
+            return json.dumps(RDAP_NOT_FOUND)
+        if response.status_code == 429:
+            # A throttled registry isn't a broken one
+            report_whois_response(host, "too many requests")
+            raise WhoisRateLimitedError(f"RDAP server {host} returned 429 Too Many Requests")
+        if response.status_code != 200:
+            return f"Error querying RDAP server {host}: HTTP {response.status_code}"
+        
+        report_whois_response(host, "")
+        try:
+            data = response.json()
+        except ValueError as e:
+            return f"Error querying RDAP server {host}: invalid JSON ({e})"
+        if not isinstance(data, dict):
+            return f"Error querying RDAP server {host}: unexpected answer"
+        return json.dumps(data, ensure_ascii=False)
+
+class HedgedBackend(WhoisBackend):
+    """Send lookups to a primary backend, hedging and failing over to a secondary.
+
+    If the primary hasn't answered within its WHOIS_HEDGE_PERCENTILE latency,
+    the same query goes to the secondary and the first good answer wins; the
+    other request is cancelled. After WHOIS_FAILOVER_THRESHOLD consecutive
+    failures the primary is skipped entirely for WHOIS_FAILOVER_COOLDOWN seconds.
+    """
+    name = "hedged"
+    
+    def __init__(self):
+        self.primary = get_whois_backend(WHOIS_PRIMARY_BACKEND)
+        self.secondary = get_whois_backend(WHOIS_SECONDARY_BACKEND)
+        self.latencies = deque(maxlen=200)
+        self.consecutive_failures = 0
+        self.primary_down_until = 0.0
+    
+    async def start(self) -> None:
+        await asyncio.gather(self.primary.start(), self.secondary.start())
+    
+    def hedge_delay(self) -> float:
+        """Return how long to wait for the primary before asking the secondary."""
+        if len(self.latencies) < WHOIS_HEDGE_MIN_SAMPLES:
+            return WHOIS_HEDGE_MIN_DELAY
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * WHOIS_HEDGE_PERCENTILE / 100))
+        return max(WHOIS_HEDGE_MIN_DELAY, ordered[index])
+    
+    def record_primary(self, ok: bool) -> None:
+        """Track primary health and take it out of rotation after repeated failures."""
+        if ok:
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= WHOIS_FAILOVER_THRESHOLD and time.monotonic() >= self.primary_down_until:
+            self.primary_down_until = time.monotonic() + WHOIS_FAILOVER_COOLDOWN
+            hedge_stats["failovers"] += 1
+            logger.warning(
+                f"Primary WHOIS backend '{self.primary.name}' failed {self.consecutive_failures} times, "
+                f"using '{self.secondary.name}' for {WHOIS_FAILOVER_COOLDOWN:.0f}s"
+            )
+    
+    async def timed_primary_lookup(self, domain: str) -> str:
+        """Run the primary lookup, recording its latency and health."""
+        started = time.monotonic()
+        try:
+            whois_output = await self.primary.lookup(domain)
+        except asyncio.CancelledError:
+            # Lost the race - still a useful (lower bound) latency sample
+            self.latencies.append(time.monotonic() - started)
+            raise
+        except WhoisRateLimitedError:
+            # Our own limiter said no, the primary itself may be fine
+            raise
+        except Exception:
+            self.record_primary(False)
+            raise
+        self.latencies.append(time.monotonic() - started)
+        self.record_primary(not is_whois_error(whois_output))
+        return whois_output
+    
+    async def lookup(self, domain: str) -> str:
+        hedge_stats["requests"] += 1
+        
+        # Primary is considered down - go straight to the secondary
+        if time.monotonic() < self.primary_down_until:
+            hedge_stats["secondary_wins"] += 1
+            return await self.secondary.lookup(domain)
+        
+        # Both tasks are cancelled on the way out, even if the caller's deadline
+        # hits during the primary's head start
+        primary = asyncio.create_task(self.timed_primary_lookup(domain))
+        secondary = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay())
+            if done and not primary.exception() and not is_whois_error(primary.result()):
+                return primary.result()
+            
+            # Too slow, or failed: race the secondary against whatever the primary is doing
+            hedge_stats["hedged"] += 1
+            secondary = asyncio.create_task(self.secondary.lookup(domain))
+            pending = {secondary} if done else {primary, secondary}
+            fallback = primary
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() or is_whois_error(task.result()):
+                        fallback = task
+                        continue
+                    if task is secondary:
+                        hedge_stats["secondary_wins"] += 1
+                    return task.result()
+        finally:
+            for task in (primary, secondary):
+                if task is not None:
+                    task.cancel()
+        
+        # Both failed - report the last failure
+        return fallback.result()
+
+WHOIS_BACKEND_CLASSES = {
+    backend_class.name: backend_class
+    for backend_class in (SSHBackend, LocalBackend, NativeBackend, FixtureBackend, RDAPBackend, HedgedBackend)
+}
+
+def get_whois_backend(name: str = None) -> WhoisBackend:
+    """Return the backend instance for a name (the configured one by default)."""
+    name = name or WHOIS_BACKEND
+    backend = whois_backends.get(name)
+    if backend is None:
+        if name not in WHOIS_BACKEND_CLASSES:
+            raise ValueError(f"Unknown WHOIS backend '{name}', expected one of: {', '.join(WHOIS_BACKEND_CLASSES)}")
+        backend = WHOIS_BACKEND_CLASSES[name]()
+        whois_backends[name] = backend
+    return backend
+
+def record_whois_output(domain: str, whois_output: str) -> None:
+    """Save a backend output to WHOIS_RECORD_DIR so it can be replayed later."""
+    try:
+        os.makedirs(WHOIS_RECORD_DIR, exist_ok=True)
+        with open(fixture_path(WHOIS_RECORD_DIR, domain), 'w', encoding='utf-8') as f:
+            f.write(whois_output)
+    except Exception as e:
+        logger.error(f"Error recording WHOIS output for {domain}: {e}")
+
+# Circuit breaker
+def get_circuit_breaker(key: str) -> dict:
+    """Return the circuit breaker for a backend's upstream server, creating it closed."""
+    breaker = circuit_breakers.get(key)
+    if breaker is None:
+        breaker = {"state": "closed", "failures": 0, "opened_at": 0.0, "probing": False}
+        circuit_breakers[key] = breaker
+    return breaker
+
+def allow_circuit_request(key: str) -> None:
+    """Raise WhoisUnavailableError unless the breaker lets this request through.
+
+    An open breaker fails fast until CIRCUIT_RESET_TIMEOUT has passed, then
+    lets exactly one probe through (half-open) while everyone else keeps
+    failing fast.
+    """
+    breaker = get_circuit_breaker(key)
+    if breaker["state"] == "closed":
+        return
+    
+    if breaker["state"] == "open" and time.monotonic() - breaker["opened_at"] >= CIRCUIT_RESET_TIMEOUT:
+        breaker["state"] = "half_open"
+    if breaker["state"] == "half_open" and not breaker["probing"]:
+        breaker["probing"] = True
+        logger.info(f"Circuit for '{key}' is half-open, sending a probe")
+        return
+    
+    raise WhoisUnavailableError(f"WHOIS lookups through '{key}' are unavailable (circuit open)")
+
+def record_circuit_result(key: str, ok: bool) -> None:
+    """Close the breaker on success, open it after too many consecutive failures."""
+    breaker = get_circuit_breaker(key)
+    breaker["probing"] = False
+    if ok:
+        if breaker["state"] != "closed":
+            logger.info(f"Circuit for '{key}' closed again")
+        breaker["state"] = "closed"
+        breaker["failures"] = 0
+        return
+    
+    breaker["failures"] += 1
+    if breaker["state"] == "half_open" or breaker["failures"] >= CIRCUIT_FAILURE_THRESHOLD:
+        if breaker["state"] != "open":
+            logger.warning(f"Circuit for '{key}' opened after {breaker['failures']} failures")
+        breaker["state"] = "open"
+        breaker["opened_at"] = time.monotonic()
+
+def circuit_summary() -> str:
+    """Return a short human readable summary of the circuit breakers that aren't closed."""
+    tripped = [f"{key} {breaker['state']}" for key, breaker in circuit_breakers.items() if breaker["state"] != "closed"]
+    return ", ".join(tripped) or f"{len(circuit_breakers)} closed"
+
+async def get_whois_info(domain: str) -> str:
+    """Get WHOIS information using the configured backend.
+
+    Raises WhoisTimeoutError if the lookup doesn't finish within
+    WHOIS_TOTAL_TIMEOUT (the backend's process or socket is cancelled),
+    WhoisRateLimitedError if a rate limit won't let it through in that time or
+    the server answered with a rate limit notice, WhoisBackendError if the
+    backend returned an error message, and WhoisUnavailableError without
+    trying while the circuit for the upstream server is open.
+    
+    Each upstream server has its own circuit, so one slow or broken registry
+    doesn't fail the lookups for every other TLD.
+    """
+    backend = get_whois_backend()
+    circuit = backend.circuit_key(domain)
+    allow_circuit_request(circuit)
+    # Rate limiters fail fast rather than wait past this
+    deadline = whois_lookup_deadline.set(time.monotonic() + WHOIS_TOTAL_TIMEOUT)
+    try:
+        whois_output = await asyncio.wait_for(backend.lookup(domain), timeout=WHOIS_TOTAL_TIMEOUT)
+    except asyncio.TimeoutError:
+        record_circuit_result(circuit, False)
+        raise WhoisTimeoutError(f"WHOIS lookup for {domain} timed out after {WHOIS_TOTAL_TIMEOUT:.0f}s") from None
+    except (asyncio.CancelledError, WhoisRateLimitedError):
+        # Not the upstream's fault (our own rate limiter refused to wait, or it throttled
+        # us) - just free the probe slot if we held it
+        get_circuit_breaker(circuit)["probing"] = False
+        raise
+    except Exception:
+        record_circuit_result(circuit, False)
+        raise
+    finally:
+        whois_lookup_deadline.reset(deadline)
+    
+    # A quota notice is no verdict on the domain, and no failure of the backend either
+    if not is_whois_error(whois_output) and not is_rdap_output(whois_output) and WHOIS_QUOTA_PATTERNS.search(whois_output):
+        get_circuit_breaker(circuit)["probing"] = False
+        raise WhoisRateLimitedError(f"WHOIS server for {domain} answered with a rate limit notice")
+    if is_whois_error(whois_output):
+        record_circuit_result(circuit, False)
+        raise WhoisBackendError(whois_output)
+    record_circuit_result(circuit, True)
+    
+    if WHOIS_RECORD_DIR:
+        await asyncio.to_thread(record_whois_output, domain, whois_output)
+    return whois_output
+
+# Lookup scheduler
+async def lookup_worker() -> None:
+    """Run queued backend lookups, highest priority first."""
+    while True:
+        _, _, lookup = await lookup_queue.get()
+        try:
+            # Skip lookups that were cancelled or already picked up at a higher priority
+            if lookup["future"].done() or lookup["started"]:
+                continue
+            lookup["started"] = True
+            
+            stats = lookup_stats[PRIORITY_NAMES[lookup["priority"]]]
+            wait = time.monotonic() - lookup["enqueued_at"]
+            stats["wait_total"] += wait
+            stats["wait_max"] = max(stats["wait_max"], wait)
+            
+            try:
+                result = await get_whois_info(lookup["domain"])
+            except Exception as e:
+                if not lookup["future"].done():
+                    lookup["future"].set_exception(e)
+            else:
+                if not lookup["future"].done():
+                    lookup["future"].set_result(result)
+            stats["completed"] += 1
+        finally:
+            lookup_queue.task_done()
+
+def start_lookup_scheduler() -> None:
+    """Create the lookup queue and its worker tasks."""
+    global lookup_queue
+    if lookup_workers:
+        return
+    lookup_queue = asyncio.PriorityQueue()
+    for _ in range(LOOKUP_WORKERS):
+        lookup_workers.append(asyncio.create_task(lookup_worker()))
+    logger.info(f"Lookup scheduler started with {LOOKUP_WORKERS} workers")
+
+def stop_lookup_scheduler() -> None:
+    """Cancel the worker tasks."""
+    for task in lookup_workers:
+        task.cancel()
+    lookup_workers.clear()
+
+def enqueue_lookup(lookup: dict, priority: int) -> None:
+    """Put a lookup on the queue at the given priority."""
+    global lookup_sequence
+    lookup_sequence += 1
+    lookup["priority"] = priority
+    # The sequence number keeps FIFO order within a priority class
+    lookup_queue.put_nowait((priority, lookup_sequence, lookup))
+
+def promote_lookup(domain: str, priority: int) -> None:
+    """Move a queued lookup up to a higher priority class."""
+    lookup = lookup_queued.get(normalize_domain(domain))
+    if lookup is not None and not lookup["started"] and priority < lookup["priority"]:
+        # The old queue entry stays behind and is skipped once this one has started
+        enqueue_lookup(lookup, priority)
+
+async def schedule_whois_lookup(domain: str, priority: int = PRIORITY_INTERACTIVE) -> str:
+    """Run a backend lookup through the bounded, prioritized scheduler."""
+    start_lookup_scheduler()
+    
+    lookup = {
+        "domain": domain,
+        "future": asyncio.get_running_loop().create_future(),
+        "enqueued_at": time.monotonic(),
+        "started": False
+    }
+    lookup_queued[domain] = lookup
+    lookup_stats[PRIORITY_NAMES[priority]]["queued"] += 1
+    enqueue_lookup(lookup, priority)
+    try:
+        return await lookup["future"]
+    finally:
+        if lookup_queued.get(domain) is lookup:
+            del lookup_queued[domain]
+
+def lookup_queue_summary() -> str:
+    """Return a short human readable summary of the scheduler state."""
+    depth = lookup_queue.qsize() if lookup_queue is not None else 0
+    parts = []
+    for name, stats in lookup_stats.items():
+        avg_wait = stats["wait_total"] / stats["completed"] if stats["completed"] else 0
+        parts.append(f"{name} {stats['completed']} done (avg wait {avg_wait:.2f}s, max {stats['wait_max']:.2f}s)")
+    waiting = sum(not lookup["started"] for lookup in lookup_queued.values())
+    return f"{depth} queued, {waiting} waiting; " + ", ".join(parts)
+
+# Persistent WHOIS cache
+def whois_cache_ttl(record: WhoisRecord) -> int:
+    """Pick how long a WHOIS result may be cached, based on what it says.
+
+    A registered domain that expires far in the future won't change soon and
+    can be kept for a long time; one that is about to expire (or is already in
+    its grace period) may change hands any day.
+    """
+    if record.available:
+        return WHOIS_NEGATIVE_CACHE_TTL
+    
+    expiry = record.expires
+    if expiry is None:
+        return WHOIS_DB_DEFAULT_TTL
+    
+    # Cache for a tenth of the time left until expiry, within the configured bounds
+    seconds_left = (expiry - datetime.now(timezone.utc)).total_seconds()
+    return int(min(WHOIS_DB_MAX_TTL, max(WHOIS_DB_MIN_TTL, seconds_left / 10)))
+
+def get_whois_db() -> sqlite3.Connection:
+    """Open (once) the persistent WHOIS cache database in WAL mode."""
+    global whois_db
+    if whois_db is None:
+        whois_db = sqlite3.connect(WHOIS_DB_FILE, check_same_thread=False)
+        whois_db.execute("PRAGMA journal_mode=WAL")
+        whois_db.execute("PRAGMA synchronous=NORMAL")
+        whois_db.execute(
+            "CREATE TABLE IF NOT EXISTS whois_cache ("
+            "domain TEXT PRIMARY KEY, "
+            "output TEXT NOT NULL, "
+            "available INTEGER NOT NULL, "
+            "fetched_at REAL NOT NULL, "
+            "expires_at REAL NOT NULL, "
+            "domain_expires REAL)"
+        )
+        # Databases created before domain expiry dates were stored lack the column
+        columns = {row[1] for row in whois_db.execute("PRAGMA table_info(whois_cache)")}
+        if "domain_expires" not in columns:
+            whois_db.execute("ALTER TABLE whois_cache ADD COLUMN domain_expires REAL")
+        whois_db.execute("CREATE INDEX IF NOT EXISTS whois_cache_expires_at ON whois_cache (expires_at)")
+        whois_db.execute("CREATE INDEX IF NOT EXISTS whois_cache_domain_expires ON whois_cache (domain_expires)")
+        whois_db.commit()
+    return whois_db
+
+def whois_db_get(domain: str):
+    """Return a non-expired (output, available, fetched_at, expires_at) row, or None."""
+    with whois_db_lock:
+        return get_whois_db().execute(
+            "SELECT output, available, fetched_at, expires_at FROM whois_cache "
+            "WHERE domain = ? AND expires_at > ?",
+            (domain, time.time())
+        ).fetchone()
+
+def whois_db_put(domain: str, whois_output: str, is_available: bool, ttl: int, domain_expires=None) -> None:
+    """Store a WHOIS result with its verdict, fetch time and the domain's expiry date."""
+    now = time.time()
+    with whois_db_lock:
+        db = get_whois_db()
+        db.execute(
+            "INSERT OR REPLACE INTO whois_cache (domain, output, available, fetched_at, expires_at, domain_expires) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (domain, whois_output, int(is_available), now, now + ttl,
+             domain_expires.timestamp() if domain_expires else None)
+        )
+        db.commit()
+
+def whois_db_delete(domain: str) -> None:
+    """Remove a domain from the persistent cache."""
+    with whois_db_lock:
+        db = get_whois_db()
+        db.execute("DELETE FROM whois_cache WHERE domain = ?", (domain,))
+        db.commit()
+
+def whois_db_get_stale(domain: str):
+    """Return the last known registered-domain output even if expired, or None."""
+    with whois_db_lock:
+        row = get_whois_db().execute(
+            "SELECT output FROM whois_cache WHERE domain = ? AND available = 0",
+            (domain,)
+        ).fetchone()
+    return row[0] if row else None
+
+def whois_db_expiring(within_days: int) -> list:
+    """Return (domain, expiry datetime) for cached registered domains expiring within some days, soonest first."""
+    now = time.time()
+    with whois_db_lock:
+        rows = get_whois_db().execute(
+            "SELECT domain, domain_expires FROM whois_cache "
+            "WHERE available = 0 AND domain_expires BETWEEN ? AND ? ORDER BY domain_expires",
+            (now, now + within_days * 86400)
+        ).fetchall()
+    return [(domain, datetime.fromtimestamp(expires, timezone.utc)) for domain, expires in rows]
+
+def whois_db_cleanup() -> int:
+    """Delete rows that expired longer than WHOIS_DB_STALE_GRACE ago and return how many were removed."""
+    with whois_db_lock:
+        db = get_whois_db()
+        deleted = db.execute(
+            "DELETE FROM whois_cache WHERE expires_at <= ?",
+            (time.time() - WHOIS_DB_STALE_GRACE,)
+        ).rowcount
+        db.commit()
+    return deleted
+
+async def whois_db_cleanup_loop() -> None:
+    """Periodically remove expired entries from the persistent cache."""
+    while True:
+        await asyncio.sleep(WHOIS_DB_CLEANUP_INTERVAL)
+        try:
+            deleted = await asyncio.to_thread(whois_db_cleanup)
+            if deleted:
+                logger.info(f"Removed {deleted} expired entries from the WHOIS cache database")
+        except Exception as e:
+            logger.error(f"Error cleaning up the WHOIS cache database: {e}")
+
+async def open_whois_db() -> None:
+    """Open the persistent cache and start the cleanup loop."""
+    global whois_db_cleanup_task
+    try:
+        await asyncio.to_thread(get_whois_db)
+    except Exception as e:
+        logger.error(f"Error opening the WHOIS cache database: {e}")
+        return
+    if whois_db_cleanup_task is None:
+        whois_db_cleanup_task = asyncio.create_task(whois_db_cleanup_loop())
+
+def close_whois_db() -> None:
+    """Stop the cleanup loop and close the persistent cache."""
+    global whois_db, whois_db_cleanup_task
+    if whois_db_cleanup_task is not None:
+        whois_db_cleanup_task.cancel()
+        whois_db_cleanup_task = None
+    with whois_db_lock:
+        if whois_db is not None:
+            whois_db.close()
+            whois_db = None
+
+# WHOIS result cache
+def normalize_domain(domain: str) -> str:
+    """Normalize a domain name for use as a cache key."""
+    return domain.strip().lower().rstrip('.')
+
+def is_whois_error(whois_output: str) -> bool:
+    """Check whether a lookup result is an error message rather than WHOIS data."""
+    return whois_output.startswith(WHOIS_ERROR_PREFIXES)
+
+def whois_cache_get(domain: str):
+    """Return the cached WHOIS record for a domain, or None if missing or expired."""
+    key = normalize_domain(domain)
+    for cache in (whois_cache, whois_negative_cache):
+        entry = cache.get(key)
+        if entry is None:
+            continue
+        
+        expires_at, record = entry
+        if expires_at <= time.monotonic():
+            del cache[key]
+            break
+        
+        # Mark as most recently used
+        cache.move_to_end(key)
+        whois_cache_stats["hits"] += 1
+        if cache is whois_negative_cache:
+            whois_cache_stats["negative_hits"] += 1
+        return record
+    
+    whois_cache_stats["misses"] += 1
+    return None
+
+def whois_cache_peek(domain: str) -> bool:
+    """Check whether a fresh WHOIS record is cached in memory, without counting a hit or miss."""
+    key = normalize_domain(domain)
+    now = time.monotonic()
+    return any(key in cache and cache[key][0] > now for cache in (whois_cache, whois_negative_cache))
+
+def whois_cache_put(domain: str, record: WhoisRecord, ttl: int = None) -> None:
+    """Store a WHOIS record, evicting the least recently used entries when full."""
+    key = normalize_domain(domain)
+    if record.available:
+        cache, max_entries = whois_negative_cache, WHOIS_NEGATIVE_CACHE_MAX_ENTRIES
+        ttl = WHOIS_NEGATIVE_CACHE_TTL if ttl is None else ttl
+    else:
+        cache, max_entries = whois_cache, WHOIS_CACHE_MAX_ENTRIES
+        ttl = WHOIS_CACHE_TTL if ttl is None else ttl
+    
+    # A domain lives in only one of the caches at a time
+    whois_cache.pop(key, None)
+    whois_negative_cache.pop(key, None)
+    cache[key] = (time.monotonic() + ttl, record)
+    
+    while len(cache) > max_entries:
+        cache.popitem(last=False)
+        whois_cache_stats["evictions"] += 1
+
+async def invalidate_whois_cache(domain: str) -> None:
+    """Forget everything cached about a domain, in memory and on disk."""
+    key = normalize_domain(domain)
+    whois_cache.pop(key, None)
+    whois_negative_cache.pop(key, None)
+    try:
+        await asyncio.to_thread(whois_db_delete, key)
+    except Exception as e:
+        logger.error(f"Error deleting {key} from the WHOIS cache database: {e}")
+
+async def fetch_and_cache_whois_record(domain: str, priority: int = PRIORITY_INTERACTIVE) -> WhoisRecord:
+    """Get a WHOIS record from the persistent cache or the backend, and cache it."""
+    # The persistent cache survives restarts, so try it before the backend
+    try:
+        row = await asyncio.to_thread(whois_db_get, domain)
+    except Exception as e:
+        logger.error(f"Error reading the WHOIS cache database: {e}")
+        row = None
+    if row is not None:
+        whois_output, is_available, _, expires_at = row
+        whois_inflight_stats["db_hits"] += 1
+        record = parse_whois_record(domain, whois_output, bool(is_available))
+        whois_cache_put(domain, record, min(WHOIS_CACHE_TTL, expires_at - time.time()))
+        return record
+    
+    # Callers that joined while the disk cache was read may be more urgent
+    entry = whois_inflight.get(domain)
+    if entry is not None:
+        priority = min(priority, entry["priority"])
+    
+    whois_inflight_stats["backend_calls"] += 1
+    try:
+        whois_output = await schedule_whois_lookup(domain, priority)
+    except (WhoisUnavailableError, WhoisRateLimitedError, WhoisBackendError):
+        # While the backend is down, failing or throttled, an old answer for a registered domain
+        # beats none (an old "available" verdict is too likely to be wrong to reuse)
+        try:
+            stale_output = await asyncio.to_thread(whois_db_get_stale, domain)
+        except Exception as e:
+            logger.error(f"Error reading the WHOIS cache database: {e}")
+            stale_output = None
+        if stale_output is None:
+            raise
+        whois_inflight_stats["stale_served"] += 1
+        return parse_whois_record(domain, stale_output, False)
+    
+    record = parse_whois_record(domain, whois_output)
+    
+    # An error page must never be shown or remembered as "available"
+    if record.available and not is_rdap_output(whois_output) and has_whois_error_message(whois_output):
+        raise WhoisBackendError(f"WHOIS output for {domain} looks like an error message")
+    
+    ttl = whois_cache_ttl(record)
+    whois_cache_put(domain, record, min(WHOIS_CACHE_TTL, ttl))
+    try:
+        await asyncio.to_thread(whois_db_put, domain, whois_output, record.available, ttl, record.expires)
+    except Exception as e:
+        logger.error(f"Error writing the WHOIS cache database: {e}")
+    return record
+
+async def get_cached_whois_record(domain: str, priority: int = PRIORITY_INTERACTIVE) -> WhoisRecord:
+    """Get a parsed WHOIS record through the result cache.
+
+    Concurrent callers for the same domain share a single backend lookup,
+    which runs at the most urgent priority any of them asked for.
+    """
+    record = whois_cache_get(domain)
+    if record is not None:
+        return record
+    
+    key = normalize_domain(domain)
+    entry = whois_inflight.get(key)
+    if entry is None:
+        entry = {"task": asyncio.create_task(fetch_and_cache_whois_record(key, priority)), "priority": priority}
+        whois_inflight[key] = entry
+        
+        def forget_inflight(_):
+            if whois_inflight.get(key) is entry:
+                del whois_inflight[key]
+        entry["task"].add_done_callback(forget_inflight)
+    else:
+        whois_inflight_stats["coalesced"] += 1
+        # Also recorded on the entry, in case the lookup isn't queued yet
+        entry["priority"] = min(entry["priority"], priority)
+        promote_lookup(key, priority)
+    
+    # Shield the shared lookup so one impatient caller can't cancel it for everyone
+    return await asyncio.shield(entry["task"])
+
+# Speculative prefetch
+async def run_prefetch(domain: str) -> None:
+    """Fetch a domain at prefetch priority so it is cached before the user taps."""
+    global prefetch_inflight
+    prefetch_inflight += 1
+    try:
+        await get_cached_whois_record(domain, PRIORITY_PREFETCH)
+        prefetch_stats["completed"] += 1
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.debug(f"Prefetch for {domain} failed: {e}")
+    finally:
+        prefetch_inflight -= 1
+
+def start_prefetch(user_id: int, domain: str) -> None:
+    """Start a background lookup for a domain a user just sent, within the prefetch budget."""
+    if not PREFETCH_ENABLED:
+        return
+    
+    key = normalize_domain(domain)
+    current = prefetch_tasks.get(user_id)
+    if current is not None and current[0] == key:
+        return
+    
+    # A user only ever needs the prefetch for the last domain they sent
+    cancel_prefetch(user_id)
+    
+    if key in whois_cache or key in whois_negative_cache or key in whois_inflight:
+        prefetch_stats["skipped"] += 1
+        return
+    
+    # Prefetches get a fixed share of the workers so they can't starve interactive lookups
+    if prefetch_inflight >= PREFETCH_MAX_INFLIGHT:
+        prefetch_stats["skipped"] += 1
+        return
+    
+    task = asyncio.create_task(run_prefetch(key))
+    prefetch_tasks[user_id] = (key, task)
+    prefetch_stats["started"] += 1
+    
+    def forget_prefetch(_):
+        if prefetch_tasks.get(user_id, (None, None))[1] is task:
+            del prefetch_tasks[user_id]
+    task.add_done_callback(forget_prefetch)
+
+def cancel_prefetch(user_id: int) -> None:
+    """Cancel a user's pending prefetch, including its queued backend lookup."""
+    entry = prefetch_tasks.pop(user_id, None)
+    if entry is None:
+        return
+    
+    key, task = entry
+    if task.done():
+        return
+    
+    # Drop the shared lookup too, unless another caller has joined it (which raises its
+    # priority) or a worker is already running it
+    entry = whois_inflight.get(key)
+    lookup = lookup_queued.get(key)
+    if entry is not None and entry["priority"] == PRIORITY_PREFETCH and not (lookup and lookup["started"]):
+        # Later callers start a new lookup instead of joining the cancelled one
+        del whois_inflight[key]
+        entry["task"].cancel()
+    
+    task.cancel()
+    prefetch_stats["cancelled"] += 1
+
+def cancel_all_prefetches() -> None:
+    """Cancel every pending prefetch."""
+    for user_id in list(prefetch_tasks):
+        cancel_prefetch(user_id)
+
+# DNS pre-check
+DNS_TYPE_NS = 2
+DNS_CLASS_IN = 1
+DNS_FLAG_RESPONSE = 0x8000
+DNS_FLAG_RECURSION_DESIRED = 0x0100
+DNS_RCODE_NXDOMAIN = 3
+
+def build_dns_query(domain: str) -> bytes:
+    """Build a recursive NS query for a domain, with a random query id."""
+    header = struct.pack("!HHHHHH", secrets.randbits(16), DNS_FLAG_RECURSION_DESIRED, 1, 0, 0, 0)
+    name = b"".join(bytes([len(label)]) + label for label in domain.encode('idna').split(b'.')) + b"\0"
+    return header + name + struct.pack("!HH", DNS_TYPE_NS, DNS_CLASS_IN)
+
+def skip_dns_name(message: bytes, offset: int) -> int:
+    """Return the offset just past a (possibly compressed) name in a DNS message."""
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        if length == 0:
+            return offset + 1
+        offset += 1 + length
+
+def parse_dns_ns_response(message: bytes, query: bytes):
+    """Read an NS answer: True if delegated, False on NXDOMAIN, None if it proves nothing."""
+    question = query[12:]
+    flags, _, answer_count = struct.unpack("!HHH", message[2:8])
+    # The resolver must be answering the question we asked
+    if message[:2] != query[:2] or not flags & DNS_FLAG_RESPONSE:
+        return None
+    if message[12:12 + len(question)].lower() != question:
+        return None
+    
+    rcode = flags & 0x0F
+    if rcode == DNS_RCODE_NXDOMAIN:
+        return False
+    if rcode != 0:
+        return None
+    
+    offset = 12 + len(question)
+    for _ in range(answer_count):
+        offset = skip_dns_name(message, offset)
+        record_type, _, _, data_length = struct.unpack("!HHIH", message[offset:offset + 10])
+        if record_type == DNS_TYPE_NS:
+            return True
+        offset += 10 + data_length
+    return None
+
+class DNSQueryProtocol(asyncio.DatagramProtocol):
+    """Send one DNS query over UDP and wait for the response with the same id."""
+    
+    def __init__(self, query: bytes):
+        self.query = query
+        self.response = asyncio.get_running_loop().create_future()
+    
+    def connection_made(self, transport):
+        transport.sendto(self.query)
+    
+    def datagram_received(self, data, addr):
+        # Ignore stray datagrams that don't carry our query id
+        if not self.response.done() and data[:2] == self.query[:2]:
+            self.response.set_result(data)
+    
+    def error_received(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc)
+    
+    def connection_lost(self, exc):
+        if not self.response.done():
+            self.response.set_exception(exc or ConnectionError("DNS socket closed"))
+
+async def lookup_dns_delegation(domain: str):
+    """Ask DNS_RESOLVER for a domain's NS records; True, False (NXDOMAIN) or None."""
+    query = build_dns_query(domain)
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: DNSQueryProtocol(query),
+        remote_addr=(DNS_RESOLVER, DNS_RESOLVER_PORT)
+    )
+    try:
+        response = await asyncio.wait_for(protocol.response, timeout=DNS_PRECHECK_TIMEOUT)
+    finally:
+        transport.close()
+    return parse_dns_ns_response(response, query)
+
+async def dns_precheck(domain: str) -> bool:
+    """Return True if DNS already shows the domain is registered, so WHOIS can be skipped.
+
+    Only a positive NS answer is trusted; NXDOMAIN (which registered but
+    undelegated domains also get), errors and timeouts all leave the decision to WHOIS.
+    """
+    if not DNS_PRECHECK_ENABLED:
+        return False
+    
+    key = normalize_domain(domain)
+    dns_precheck_stats["queries"] += 1
+    try:
+        delegated = await lookup_dns_delegation(key)
+    except (OSError, asyncio.TimeoutError, IndexError, struct.error, UnicodeError) as e:
+        logger.debug(f"DNS pre-check for {key} failed: {e!r}")
+        delegated = None
+    
+    if delegated:
+        dns_precheck_stats["registered"] += 1
+        return True
+    dns_precheck_stats["nxdomain" if delegated is False else "inconclusive"] += 1
+    return False
 
 def load_users():
     """Load users from file if exists."""
@@ -844,17 +3133,40 @@ def save_users():
     try:
         with open(USERS_FILE, 'w') as f:
             json.dump({"users": list(users)}, f)
-        logger.info(f"Saved {len(users)} users to file")
+        logger.debug(f"Saved {len(users)} users to file")
     except Exception as e:
         logger.error(f"Error saving users: {e}")
 
+async def on_startup(application: Application) -> None:
+    """Warm up backend connections once the event loop is running."""
+    await open_whois_db()
+    start_lookup_scheduler()
+    await get_whois_backend().start()
+
+async def on_shutdown(application: Application) -> None:
+    """Release backend connections on shutdown."""
+    cancel_all_prefetches()
+    stop_lookup_scheduler()
+    for backend in whois_backends.values():
+        await backend.close()
+    close_whois_db()
+
 def main() -> None:
     """Start the bot."""
     # Load existing users
     load_users()
     
+    # Load the TLD -> WHOIS server routing table
+    load_whois_routes()
+    
     # Create the Application
-    application = Application.builder().token(TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Add command handlers
     application.add_handler(CommandHandler("start", start))